@@ -0,0 +1,264 @@
+import datetime
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable, Optional
+
+
+# Un gruppo di allarmi equivalenti: stesso codice, descrizione, livello di
+# severità e impianto.
+AlarmKey = tuple[str, str, str, Optional[int]]
+
+
+def naive(timestamp: datetime.datetime) -> datetime.datetime:
+    r"""Nel database i timestamp sono salvati naive (vedi `update_tickets` in
+        `app.py`): per i confronti togliamo l'awareness allo stesso modo.
+    """
+    return timestamp.replace(tzinfo=None)
+
+
+class AlarmCorrelationEngine:
+    r"""Motore di correlazione degli allarmi in memoria.
+
+        Per ogni gruppo di allarmi equivalenti (`AlarmKey`) tiene gli id degli
+        allarmi non ancora collegati a un ticket, il numero totale di
+        occorrenze e il timestamp più recente del gruppo. Un gruppo deve
+        essere trasformato in ticket quando contiene almeno 2 occorrenze e
+        almeno una di queste è più recente di un'ora: sono gli stessi criteri
+        della vecchia query con `group_by` e `having`. Senza debounce ogni
+        allarme è una sola occorrenza.
+
+        Con il passare del tempo un gruppo può solo smettere di soddisfare i
+        criteri, mai iniziare: per questo basta valutare i gruppi che hanno
+        ricevuto nuovi allarmi dall'ultima valutazione (`collect`), con un
+        costo O(1) per ogni nuovo allarme invece di un'aggregazione su tutta
+        la tabella `alarms`.
+
+        Lo stato viene ricostruito dal database all'avvio e dopo un rollback
+        (`invalidate`), tramite `loader`, che ritorna tutti gli allarmi senza
+        ticket come tuple `(id, code, description, severity_level, plant_id,
+        timestamp, occurrences, last_seen)`.
+    """
+
+    def __init__(self, loader: Callable[[], Iterable[tuple]], window: datetime.timedelta = datetime.timedelta(hours=1), min_count: int = 2):
+        self.loader = loader
+        self.window = window
+        self.min_count = min_count
+
+        # Per ogni gruppo: id, timestamp e occorrenze degli allarmi senza
+        # ticket, timestamp più recente e occorrenze totali.
+        self._alarm_ids: dict[AlarmKey, dict[int, tuple[datetime.datetime, int]]] = {}
+        self._latest: dict[AlarmKey, datetime.datetime] = {}
+        self._counts: dict[AlarmKey, int] = {}
+
+        # Gruppi modificati dall'ultima valutazione.
+        self._dirty: set[AlarmKey] = set()
+
+        # Gruppo di ogni allarme, per poterlo rimuovere.
+        self._keys: dict[int, AlarmKey] = {}
+
+        self._loaded: bool = False
+        self._lock = threading.RLock()
+
+    def invalidate(self):
+        r"""Lo stato non è più allineato al database (per esempio dopo un
+            rollback): verrà ricostruito al prossimo utilizzo.
+        """
+        with self._lock:
+            self._loaded = False
+
+    def rebuild(self):
+        with self._lock:
+            self._alarm_ids.clear()
+            self._latest.clear()
+            self._counts.clear()
+            self._dirty.clear()
+            self._keys.clear()
+            self._loaded = True
+            for alarm_id, code, description, severity_level, plant_id, timestamp, occurrences, last_seen in self.loader():
+                self._add((code, description, severity_level, plant_id), alarm_id, last_seen or timestamp, occurrences or 1)
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self.rebuild()
+
+    def _add(self, key: AlarmKey, alarm_id: int, timestamp: datetime.datetime, occurrences: int = 1):
+        if alarm_id in self._keys:
+            return
+        timestamp = naive(timestamp)
+        self._keys[alarm_id] = key
+        self._alarm_ids.setdefault(key, {})[alarm_id] = (timestamp, occurrences)
+        self._counts[key] = self._counts.get(key, 0) + occurrences
+        latest = self._latest.get(key)
+        if latest is None or timestamp > latest:
+            self._latest[key] = timestamp
+        self._dirty.add(key)
+
+    def add(self, alarm: Any):
+        r"""Registra un nuovo allarme senza ticket. L'allarme deve già avere un
+            id (dopo il flush della sessione).
+        """
+        with self._lock:
+            self._ensure_loaded()
+            self._add(
+                (alarm.code, alarm.description, alarm.severity_level, alarm.plant_id),
+                alarm.id,
+                alarm.last_seen or alarm.timestamp,
+                alarm.occurrences or 1
+            )
+
+    def touch(self, alarm_id: int, last_seen: datetime.datetime, occurrences: int):
+        r"""Aggiorna un allarme esistente a cui il debounce ha aggiunto
+            occorrenze. Gli allarmi già collegati a un ticket vengono ignorati.
+        """
+        with self._lock:
+            self._ensure_loaded()
+            key = self._keys.get(alarm_id)
+            if key is None:
+                return
+            last_seen = naive(last_seen)
+            ids = self._alarm_ids[key]
+            self._counts[key] += occurrences - ids[alarm_id][1]
+            ids[alarm_id] = (last_seen, occurrences)
+            if last_seen > self._latest[key]:
+                self._latest[key] = last_seen
+            self._dirty.add(key)
+
+    def remove(self, alarm_ids: Iterable[int]):
+        r"""Rimuove allarmi collegati a un ticket al di fuori del motore (per
+            esempio con POST /ticket).
+        """
+        with self._lock:
+            self._ensure_loaded()
+            for alarm_id in alarm_ids:
+                key = self._keys.pop(alarm_id, None)
+                if key is None:
+                    continue
+                ids = self._alarm_ids[key]
+                timestamp, occurrences = ids.pop(alarm_id)
+                if not ids:
+                    del self._alarm_ids[key]
+                    del self._latest[key]
+                    del self._counts[key]
+                    self._dirty.discard(key)
+                else:
+                    self._counts[key] -= occurrences
+                    if timestamp >= self._latest[key]:
+                        self._latest[key] = max(t for t, _ in ids.values())
+
+    def collect(self, now: datetime.datetime) -> list[tuple[AlarmKey, list[int]]]:
+        r"""Ritorna i gruppi di allarmi per cui aprire un ticket, rimuovendoli
+            dallo stato. `now` è il momento della valutazione (naive).
+        """
+        window_start = naive(now) - self.window
+        groups: list[tuple[AlarmKey, list[int]]] = []
+        with self._lock:
+            self._ensure_loaded()
+            for key in self._dirty:
+                ids = self._alarm_ids.get(key)
+                # Come nella vecchia query (confronto `plant_id = plant_id`
+                # in SQL), gli allarmi senza impianto non aprono ticket.
+                if (ids is not None
+                   and key[3] is not None
+                   and self._counts[key] >= self.min_count
+                   and self._latest[key] >= window_start):
+                    groups.append((key, list(ids)))
+                    del self._alarm_ids[key]
+                    del self._latest[key]
+                    del self._counts[key]
+                    for alarm_id in ids:
+                        del self._keys[alarm_id]
+            self._dirty.clear()
+
+        # Stesso ordine del `group_by` della vecchia query.
+        return sorted(groups)
+
+
+@dataclass(frozen=True)
+class DebounceRule:
+    # Le ripetizioni di un allarme entro `window` dall'ultima occorrenza
+    # vengono accorpate nella stessa riga.
+    window: datetime.timedelta
+
+    # Numero massimo di occorrenze per riga: raggiunto il limite viene
+    # creata una nuova riga. Con 0 non c'è limite.
+    max_occurrences: int = 0
+
+    # Margine di isteresi sul valore misurato: una ripetizione il cui valore
+    # si discosta più di `hysteresis` da quello della prima occorrenza crea
+    # una nuova riga. Con `None` il valore non viene controllato.
+    hysteresis: Optional[float] = None
+
+
+# Un allarme aperto dal debounce: stesso codice, descrizione e impianto.
+DebounceKey = tuple[str, str, Optional[int]]
+
+
+class AlarmDebouncer:
+    r"""Debounce degli allarmi in memoria.
+
+        Un sensore fuori range crea un allarme a ogni lettura. Per i codici
+        allarme con una `DebounceRule`, le ripetizioni dello stesso allarme
+        (stesso codice, descrizione e impianto) vengono invece accorpate
+        nell'ultima riga creata, aggiornandone `occurrences` e `last_seen`.
+
+        Per ogni allarme aperto viene tenuto in memoria l'id della riga, il
+        timestamp dell'ultima occorrenza, il numero di occorrenze e il valore
+        della prima occorrenza. Lo stato non viene ricostruito dal database:
+        dopo un rollback o un riavvio (`invalidate`) la prossima ripetizione
+        crea semplicemente una nuova riga.
+    """
+
+    def __init__(self, rules: dict[str, DebounceRule]):
+        self.rules = rules
+
+        self._open: dict[DebounceKey, list] = {}
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        with self._lock:
+            self._open.clear()
+
+    def rule(self, code: str) -> Optional[DebounceRule]:
+        return self.rules.get(code)
+
+    def match(self, code: str, description: str, plant_id: Optional[int], timestamp: datetime.datetime, value: Optional[float] = None) -> Optional[tuple[int, datetime.datetime, int]]:
+        r"""Se l'allarme può essere accorpato in una riga esistente, aggiorna lo
+            stato e ritorna `(id, last_seen, occurrences)` della riga,
+            altrimenti ritorna `None`.
+        """
+        rule = self.rules.get(code)
+        if rule is None:
+            return None
+
+        timestamp = naive(timestamp)
+        key: DebounceKey = (code, description, plant_id)
+        with self._lock:
+            entry = self._open.get(key)
+            if entry is None:
+                return None
+            alarm_id, last_seen, occurrences, first_value = entry
+            if (abs(timestamp - last_seen) > rule.window
+               or (rule.max_occurrences and occurrences >= rule.max_occurrences)
+               or (rule.hysteresis is not None
+                   and value is not None
+                   and first_value is not None
+                   and abs(value - first_value) > rule.hysteresis)):
+                del self._open[key]
+                return None
+
+            entry[1] = max(last_seen, timestamp)
+            entry[2] = occurrences + 1
+            return alarm_id, entry[1], entry[2]
+
+    def opened(self, code: str, description: str, plant_id: Optional[int], alarm_id: int, timestamp: datetime.datetime, value: Optional[float] = None):
+        r"""Registra una nuova riga di allarme, in cui accorpare le prossime
+            ripetizioni.
+        """
+        if code not in self.rules:
+            return
+        with self._lock:
+            self._open[(code, description, plant_id)] = [alarm_id, naive(timestamp), 1, value]
+
+    def discard(self, code: str, description: str, plant_id: Optional[int]):
+        with self._lock:
+            self._open.pop((code, description, plant_id), None)
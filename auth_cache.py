@@ -0,0 +1,122 @@
+import collections
+import hashlib
+import hmac
+import os
+import threading
+import time
+from typing import Callable, Iterable
+
+
+class TokenCache:
+    r"""Cache in memoria dei token API validi, locale al processo.
+
+        I token validi sono tenuti in un `frozenset` immutabile che viene
+        ricostruito da zero (`reload`) quando viene inserito un nuovo token:
+        la verifica di un token è quindi un semplice controllo O(1) senza
+        lock. I token non validi vengono ricordati per `negative_ttl` secondi,
+        così i client che riprovano con un token sbagliato non interrogano il
+        database a ogni richiesta.
+    """
+
+    def __init__(self, loader: Callable[[], Iterable[str]], lookup: Callable[[str], bool], negative_ttl: float = 30.0, max_negative_entries: int = 10000):
+        # `loader` ritorna tutti i token validi, `lookup` controlla un singolo
+        # token nel database.
+        self.loader = loader
+        self.lookup = lookup
+        self.negative_ttl = negative_ttl
+        self.max_negative_entries = max_negative_entries
+
+        self._tokens: frozenset[str] = frozenset()
+        self._negative: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def reload(self):
+        r"""Ricostruisce l'insieme dei token validi dal database."""
+        tokens = frozenset(self.loader())
+        with self._lock:
+            self._tokens = tokens
+            self._negative.clear()
+
+    def is_valid(self, api_token: str) -> bool:
+        if api_token in self._tokens:
+            return True
+
+        now: float = time.monotonic()
+        with self._lock:
+            expires = self._negative.get(api_token)
+            if expires is not None:
+                if expires > now:
+                    return False
+                del self._negative[api_token]
+
+        # Token sconosciuto: potrebbe essere stato inserito da un altro
+        # processo, per cui controlliamo il database una sola volta.
+        if self.lookup(api_token):
+            self.reload()
+            return True
+
+        with self._lock:
+            if len(self._negative) >= self.max_negative_entries:
+                self._negative = {t: e for t, e in self._negative.items() if e > now}
+                if len(self._negative) >= self.max_negative_entries:
+                    self._negative.clear()
+            self._negative[api_token] = now + self.negative_ttl
+
+        return False
+
+    def __len__(self) -> int:
+        return len(self._tokens)
+
+
+class CredentialCache:
+    r"""Cache limitata delle credenziali HTTP Basic già verificate.
+
+        `check_password_hash` è volutamente lento (PBKDF2) e viene chiamato
+        per ogni richiesta protetta, compresi i file statici del frontend.
+        Qui ricordiamo per `ttl` secondi le credenziali già verificate. La
+        chiave è un HMAC-SHA256 di utente e password con una chiave casuale
+        generata all'avvio del processo: le password non vengono mai tenute
+        in memoria in chiaro.
+    """
+
+    def __init__(self, ttl: float = 300.0, max_entries: int = 256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self._key: bytes = os.urandom(32)
+        self._entries: collections.OrderedDict[bytes, tuple[str, float]] = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _digest(self, username: str, password: str) -> bytes:
+        return hmac.new(
+            self._key,
+            username.encode() + b'\x00' + password.encode(),
+            hashlib.sha256
+        ).digest()
+
+    def get(self, username: str, password: str) -> str | None:
+        r"""Ritorna l'utente se le credenziali sono state verificate da meno
+            di `ttl` secondi, altrimenti `None`.
+        """
+        digest = self._digest(username, password)
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                return None
+            if entry[1] <= time.monotonic():
+                del self._entries[digest]
+                return None
+            self._entries.move_to_end(digest)
+            return entry[0]
+
+    def add(self, username: str, password: str):
+        digest = self._digest(username, password)
+        with self._lock:
+            self._entries[digest] = (username, time.monotonic() + self.ttl)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
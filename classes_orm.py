@@ -1,11 +1,13 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, ForeignKey, DateTime, Boolean
+from sqlalchemy import create_engine, Column, Integer, BigInteger, SmallInteger, String, Float, ForeignKey, DateTime, Boolean, Index, text
+from sqlalchemy.types import TypeDecorator
 from sqlalchemy.orm import sessionmaker, mapped_column, Mapped, relationship, declarative_base, deferred, declared_attr 
 import uuid
 from dataclasses import dataclass, field
 import datetime
-from typing import Optional, Tuple , Any
+from typing import Optional, Tuple , Any, ClassVar
 from enum import Enum
 import pprint
+import time
 
 Base = declarative_base()
 
@@ -39,6 +41,87 @@ class AlarmCode(Enum):
     PLANT_COMPONENT_PROBLEM = '04'
 
 
+# Codici allarme salvati come interi: '-01' è -1, '00' è 0 e così via.
+ALARM_CODE_IDS: dict[str, int] = {code.value: int(code.value) for code in AlarmCode}
+ALARM_CODES: dict[int, str] = {i: code for code, i in ALARM_CODE_IDS.items()}
+
+EPOCH: datetime.datetime = datetime.datetime(1970, 1, 1)
+
+# `latest_alarm_at` dei ticket senza allarmi: sono gli ultimi della lista dei
+# ticket e si possono paginare per chiave come gli altri.
+TICKET_WITHOUT_ALARMS_AT: datetime.datetime = datetime.datetime.min
+
+# Con il fuso orario locale UTC i timestamp senza fuso orario sono già in
+# UTC e si possono formattare senza conversioni.
+LOCAL_TIME_IS_UTC: bool = time.timezone == 0 and time.altzone == 0
+
+_day_prefixes: dict[int, str] = {}
+
+
+def format_timestamp(timestamp: Optional[datetime.datetime]) -> Optional[str]:
+    r"""Timestamp in formato UTC (Zulu) al secondo, come ritornato dalle
+        API.
+    """
+    if timestamp is None:
+        return None
+    if timestamp.tzinfo is None and LOCAL_TIME_IS_UTC:
+        return timestamp.isoformat(timespec='seconds') + 'Z'
+    return timestamp.astimezone(datetime.timezone.utc).replace(tzinfo=None).isoformat(timespec='seconds') + 'Z'
+
+
+def format_epoch(microseconds: Optional[int]) -> Optional[str]:
+    r"""Come `format_timestamp`, ma direttamente dal valore salvato da
+        `EpochTimestamp`, senza creare un `datetime`: la data di ogni giorno
+        viene formattata una volta sola.
+    """
+    if microseconds is None:
+        return None
+    if not LOCAL_TIME_IS_UTC:
+        return format_timestamp(EPOCH + datetime.timedelta(microseconds=microseconds))
+
+    day, seconds = divmod(microseconds // 1000000, 86400)
+    prefix: Optional[str] = _day_prefixes.get(day)
+    if prefix is None:
+        prefix = _day_prefixes[day] = (EPOCH + datetime.timedelta(days=day)).strftime('%Y-%m-%dT')
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    return f'{prefix}{hours:02d}:{minutes:02d}:{seconds:02d}Z'
+
+
+class EpochTimestamp(TypeDecorator):
+    r"""Timestamp salvato come intero: microsecondi dall'epoch dell'ora
+        senza fuso orario, la stessa che salvava `DateTime` su SQLite come
+        testo. In Python resta un `datetime` senza fuso orario.
+    """
+    impl = BigInteger
+    cache_ok = True
+
+    def process_bind_param(self, value: Any, dialect: Any) -> Optional[int]:
+        if value is None or isinstance(value, int):
+            return value
+        delta: datetime.timedelta = value.replace(tzinfo=None) - EPOCH
+        return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+    def process_result_value(self, value: Optional[int], dialect: Any) -> Optional[datetime.datetime]:
+        if value is None:
+            return None
+        return EPOCH + datetime.timedelta(microseconds=value)
+
+
+class AlarmCodeType(TypeDecorator):
+    r"""Codice allarme (`AlarmCode`) salvato come intero piccolo. In Python
+        resta la stringa, per esempio '-01'.
+    """
+    impl = SmallInteger
+    cache_ok = True
+
+    def process_bind_param(self, value: Optional[str], dialect: Any) -> Optional[int]:
+        return ALARM_CODE_IDS[value] if value is not None else None
+
+    def process_result_value(self, value: Optional[int], dialect: Any) -> Optional[str]:
+        return ALARM_CODES[value] if value is not None else None
+
+
 class TicketCode(Enum):
     IN_PROGRESS = 'IN PROGRESS'
     RESOLVED = 'RESOLVED'
@@ -47,6 +130,34 @@ class TicketCode(Enum):
 
 class Alarm(Base):
     __tablename__ = 'alarms'
+    __table_args__ = (
+        # Allarmi senza ticket, letti da `alarm_engine` all'avvio e dopo un
+        # rollback. Indice parziale e coprente: contiene solo gli allarmi
+        # senza ticket e tutte le colonne lette (anche `ticket_id`, che
+        # SQLite richiede per usare l'indice come coprente).
+        Index(
+            'ix_alarms_unticketed',
+            'plant_id', 'code', 'description', 'severity_level', 'timestamp', 'last_seen', 'occurrences', 'ticket_id',
+            sqlite_where=text('ticket_id IS NULL')
+        ),
+
+        # Allarmi di un ticket e timestamp dell'ultimo allarme, per la
+        # chiusura automatica dei ticket. Complementare al precedente: gli
+        # allarmi senza ticket non sono indicizzati.
+        Index(
+            'ix_alarms_ticket_id_timestamp',
+            'ticket_id', 'timestamp', 'last_seen',
+            sqlite_where=text('ticket_id IS NOT NULL')
+        ),
+
+        # Elenco degli allarmi (GET /alarm) in ordine decrescente di
+        # timestamp, tutti, solo quelli visibili (la dashboard) o di un
+        # impianto: SQLite legge gli indici al contrario, senza ordinare, e
+        # l'id è già in coda a ogni indice.
+        Index('ix_alarms_timestamp', 'timestamp'),
+        Index('ix_alarms_visible_timestamp', 'visible', 'timestamp'),
+        Index('ix_alarms_plant_id_timestamp', 'plant_id', 'timestamp'),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     code: Mapped[str] = mapped_column(String, nullable=False)
@@ -55,6 +166,12 @@ class Alarm(Base):
     timestamp: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
     visible: Mapped[bool] = mapped_column(Boolean, nullable=False, default=True)
 
+    # Con il debounce degli allarmi, le ripetizioni dello stesso allarme
+    # aggiornano questa riga invece di crearne di nuove: `occurrences` conta
+    # le ripetizioni e `last_seen` è il timestamp dell'ultima.
+    occurrences: Mapped[int] = mapped_column(Integer, nullable=False, default=1)
+    last_seen: Mapped[Optional[datetime.datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+
     # 1 allarme appartiene ad 1 impianto.
     plant_id: Mapped[int] = mapped_column(Integer, ForeignKey('plants.id'), nullable=True)
     plant: Mapped['Plant'] = relationship(
@@ -81,18 +198,71 @@ class Alarm(Base):
             'plant_id': self.plant_id,
             'ticket_id': self.ticket_id,
             'visible': self.visible,
+            'occurrences': self.occurrences,
+            'last_seen': self.last_seen.astimezone(datetime.timezone.utc).replace(tzinfo=None).isoformat(timespec='seconds') + 'Z' if self.last_seen else None,
         }
 
 
+class ArchivedAlarm(Base):
+    r"""Allarmi dei ticket chiusi spostati fuori dalla tabella `alarms` dal
+        job `archive_alarms`, con lo stesso id e le stesse colonne. Tornano
+        in `alarms` se il ticket viene riaperto.
+    """
+    __tablename__ = 'alarms_archive'
+    __table_args__ = (
+        Index('ix_alarms_archive_ticket_id', 'ticket_id'),
+        Index('ix_alarms_archive_plant_id_timestamp', 'plant_id', 'timestamp'),
+        Index('ix_alarms_archive_timestamp', 'timestamp'),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    code: Mapped[str] = mapped_column(String, nullable=False)
+    description: Mapped[str] = mapped_column(String, nullable=False)
+    severity_level: Mapped[str] = mapped_column(String, nullable=False)
+    timestamp: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    visible: Mapped[bool] = mapped_column(Boolean, nullable=False, default=False)
+    occurrences: Mapped[int] = mapped_column(Integer, nullable=False, default=1)
+    last_seen: Mapped[Optional[datetime.datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+    plant_id: Mapped[int] = mapped_column(Integer, ForeignKey('plants.id'), nullable=True)
+    ticket_id: Mapped[int] = mapped_column(Integer, ForeignKey('tickets.id'), nullable=True)
+    archived_at: Mapped[datetime.datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+
+    def serialize(self) -> dict:
+        return Alarm.serialize(self) | {'archived_at': format_timestamp(self.archived_at)}
+
+
 class Ticket(Base):
     __tablename__ = 'tickets'
+    __table_args__ = (
+        # Ticket da chiudere automaticamente.
+        Index('ix_tickets_code', 'code'),
+
+        # Lista dei ticket, in ordine decrescente di `latest_alarm_at`.
+        Index('ix_tickets_latest_alarm_at', 'latest_alarm_at', 'id'),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     code: Mapped[str] = mapped_column(String, nullable=False)
 
+    # Timestamp dell'allarme più recente del ticket, aggiornato quando gli
+    # allarmi vengono collegati al ticket (`TICKET_WITHOUT_ALARMS_AT`:
+    # ticket senza allarmi).
+    latest_alarm_at: Mapped[Optional[datetime.datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+
     # 1 ticket sarà collegato ad n allarmi dello stesso tipo, in base a certe
-    # regole.
-    alarms: Mapped[list['Alarm']] = relationship('Alarm', back_populates='ticket')
+    # regole. Gli allarmi sono in ordine decrescente di timestamp.
+    alarms: Mapped[list['Alarm']] = relationship(
+        'Alarm',
+        back_populates='ticket',
+        order_by=(Alarm.timestamp.desc(), Alarm.id)
+    )
+
+    # Allarmi del ticket spostati nell'archivio (solo lettura).
+    archived_alarms: Mapped[list['ArchivedAlarm']] = relationship(
+        'ArchivedAlarm',
+        viewonly=True,
+        order_by=(ArchivedAlarm.timestamp.desc(), ArchivedAlarm.id)
+    )
 
     # 1 ticket appartiene ad 1 impianto.
     plant_id: Mapped[int] = mapped_column(Integer, ForeignKey('plants.id'), nullable=True)
@@ -107,13 +277,22 @@ class Ticket(Base):
             'id': self.id,
             'code': self.code,
 
-            # Ordina gli allarmi in modo decrescente di timestamp: l'allarme        
-            # con timestamp più recente deve essere primo della lista degli id      
+            # Allarmi in modo decrescente di timestamp: l'allarme con
+            # timestamp più recente deve essere primo della lista degli id
             # allarmi. Questo ci servirà nel frontend.
-            'alarms': [a.id for a in sorted(self.alarms, key=lambda a: a.timestamp, reverse=True)],
+            'alarms': [a.id for a in self.all_alarms],
             'plant_id': self.plant_id,
         }
 
+    @property
+    def all_alarms(self) -> list:
+        r"""Allarmi del ticket, compresi quelli archiviati, in ordine
+            decrescente di timestamp.
+        """
+        if not self.archived_alarms:
+            return self.alarms
+        return sorted(self.alarms + self.archived_alarms, key=lambda a: a.timestamp, reverse=True)
+
 
 @dataclass
 class Token(Base):
@@ -209,22 +388,47 @@ class SensorReading(Base):
     voltage: Mapped[float] = mapped_column(Float, nullable=False)
     current: Mapped[float] = mapped_column(Float, nullable=False)
 
-    # La frequenza non ha senso per la corrente DC.
-    frequency: Mapped[Optional[float]] = mapped_column(Float, default=0.0)
+    # La frequenza non ha senso per la corrente DC: per le letture dei
+    # moduli 0.0 indica la corrente DC, per le batterie è sempre NULL.
+    frequency: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
 
-    timestamp: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
-    alarm_code: Mapped[str] = mapped_column(String, nullable=False, default='-01')
+    timestamp: Mapped[datetime.datetime] = mapped_column(EpochTimestamp, nullable=False)
+    alarm_code: Mapped[str] = mapped_column(AlarmCodeType, nullable=False, default='-01')
+
+    # Nome della colonna del dispositivo, definito nelle sottoclassi.
+    device_column: ClassVar[str] = ''
+
+    @classmethod
+    def serialize_row(cls, row: Any) -> dict:
+        r"""Serializza una riga letta con `timestamp` come intero (vedi
+            `EpochTimestamp`), senza passare da un `datetime`.
+        """
+        return {
+            'id': row.id,
+            'voltage': row.voltage,
+            'current': row.current,
+            'timestamp': format_epoch(row.timestamp),
+            'frequency': row.frequency if row.frequency is not None else 0.0,
+            'alarm_code': row.alarm_code,
+            cls.device_column: getattr(row, cls.device_column),
+        }
 
 
 class PlantModuleSystemSensorReading(SensorReading):
     # Singola lettura sensore per un modulo dell'impianto.
     __tablename__ = 'plant_module_system_sensor_readings'
+    __table_args__ = (
+        # Letture di un modulo impianto in un intervallo di tempo o ultime n
+        # letture (grafici).
+        Index('ix_pms_sensor_readings_pms_id_timestamp', 'plant_module_system_id', 'timestamp'),
+    )
 
     plant_module_system_id: Mapped[Optional[int]] = mapped_column(Integer, ForeignKey('plant_module_systems.id'), nullable=True)
+    device_column = 'plant_module_system_id'
 
     plant_module_system: Mapped[Optional['PlantModuleSystem']] = relationship('PlantModuleSystem', back_populates='plant_module_system_sensor_readings', foreign_keys=[plant_module_system_id])
 
-    def __init__(self, voltage: float, current: float, timestamp: datetime.datetime, plant_module_system: Any, frequency: float = 0.0, alarm_code: str = '-01'):
+    def __init__(self, voltage: float, current: float, timestamp: datetime.datetime, plant_module_system: Any = None, frequency: float = 0.0, alarm_code: str = '-01', plant_module_system_id: Optional[int] = None):
         self.voltage = voltage
         self.current = current
 
@@ -234,7 +438,13 @@ class PlantModuleSystemSensorReading(SensorReading):
         self.timestamp = timestamp
 
         self.alarm_code = alarm_code
-        self.plant_module_system = plant_module_system
+
+        # Si può passare l'oggetto o solo il suo id, per evitare di caricarlo
+        # dal database.
+        if plant_module_system is not None:
+            self.plant_module_system = plant_module_system
+        else:
+            self.plant_module_system_id = plant_module_system_id
 
 
     def serialize(self) -> dict:
@@ -242,8 +452,8 @@ class PlantModuleSystemSensorReading(SensorReading):
             'id': self.id,
             'voltage': self.voltage,
             'current': self.current,
-            'timestamp': self.timestamp.astimezone(datetime.timezone.utc).replace(tzinfo=None).isoformat(timespec='seconds') + 'Z' if self.timestamp else None,
-            'frequency': self.frequency,
+            'timestamp': format_timestamp(self.timestamp),
+            'frequency': self.frequency if self.frequency is not None else 0.0,
             'alarm_code': self.alarm_code,
             'plant_module_system_id': self.plant_module_system_id,
         }
@@ -253,9 +463,15 @@ class PlantBatterySystemSensorReading(SensorReading):
     # Singola lettura sensore per una batteria dell'impianto.
 
     __tablename__ = 'plant_battery_system_sensor_readings'
+    __table_args__ = (
+        # Letture di una batteria in un intervallo di tempo o ultime n
+        # letture (grafici).
+        Index('ix_pbs_sensor_readings_battery_id_timestamp', 'battery_id', 'timestamp'),
+    )
 
     # 1 lettura appartiene ad una sola batteria.
     battery_id: Mapped[int] = mapped_column(Integer, ForeignKey('batteries.id'), nullable=True)
+    device_column = 'battery_id'
 
     battery: Mapped['PlantBatterySystem'] = relationship(
         'Battery',
@@ -263,17 +479,23 @@ class PlantBatterySystemSensorReading(SensorReading):
         foreign_keys=[battery_id]
     )
 
-    def __init__(self, voltage: float, current: float, timestamp: datetime.datetime, battery: Any, frequency: float = 0.0, alarm_code: str = '-01'):
+    def __init__(self, voltage: float, current: float, timestamp: datetime.datetime, battery: Any = None, frequency: float = 0.0, alarm_code: str = '-01', battery_id: Optional[int] = None):
         self.voltage = voltage
         self.current = current
 
-        # La frequenza non ha senso per la corrente DC, quindi anche per le batterie.
-        self.frequency = 0.0
+        # La frequenza non ha senso per la corrente DC, quindi anche per le
+        # batterie: non viene salvata.
+        self.frequency = None
 
         self.timestamp = timestamp
         self.alarm_code = alarm_code
 
-        self.battery = battery
+        # Si può passare l'oggetto o solo il suo id, per evitare di caricarlo
+        # dal database.
+        if battery is not None:
+            self.battery = battery
+        else:
+            self.battery_id = battery_id
 
 
     def serialize(self) -> dict:
@@ -281,13 +503,58 @@ class PlantBatterySystemSensorReading(SensorReading):
             'id': self.id,
             'voltage': self.voltage,
             'current': self.current,
-            'timestamp': self.timestamp.astimezone(datetime.timezone.utc).replace(tzinfo=None).isoformat(timespec='seconds') + 'Z' if self.timestamp else None,
-            'frequency': self.frequency,
+            'timestamp': format_timestamp(self.timestamp),
+            'frequency': self.frequency if self.frequency is not None else 0.0,
             'alarm_code': self.alarm_code,
             'battery_id': self.battery_id,
         }
 
 
+class SensorReadingRollup(Base):
+    # Aggregati delle letture dei sensori di un dispositivo (modulo impianto
+    # o batteria) in un intervallo di tempo di `resolution` secondi che
+    # inizia a `bucket`, separati tra letture DC (frequenza 0.0, e tutte le
+    # letture delle batterie) e AC. Aggiornati a ogni inserimento di letture.
+    __tablename__ = 'sensor_reading_rollups'
+
+    # 'plant_module_system' o 'battery'.
+    device_type: Mapped[str] = mapped_column(String, primary_key=True)
+    device_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    resolution: Mapped[int] = mapped_column(Integer, primary_key=True)
+    bucket: Mapped[datetime.datetime] = mapped_column(DateTime(timezone=True), primary_key=True)
+    dc: Mapped[bool] = mapped_column(Boolean, primary_key=True)
+
+    count: Mapped[int] = mapped_column(Integer, nullable=False)
+    voltage_sum: Mapped[float] = mapped_column(Float, nullable=False)
+    voltage_min: Mapped[float] = mapped_column(Float, nullable=False)
+    voltage_max: Mapped[float] = mapped_column(Float, nullable=False)
+    current_sum: Mapped[float] = mapped_column(Float, nullable=False)
+    current_min: Mapped[float] = mapped_column(Float, nullable=False)
+    current_max: Mapped[float] = mapped_column(Float, nullable=False)
+    frequency_sum: Mapped[float] = mapped_column(Float, nullable=False)
+    frequency_min: Mapped[float] = mapped_column(Float, nullable=False)
+    frequency_max: Mapped[float] = mapped_column(Float, nullable=False)
+
+    def serialize(self) -> dict:
+        return {
+            'device_type': self.device_type,
+            'device_id': self.device_id,
+            'resolution': self.resolution,
+            'bucket': self.bucket.astimezone(datetime.timezone.utc).replace(tzinfo=None).isoformat(timespec='seconds') + 'Z' if self.bucket else None,
+            'current_type': 'DC' if self.dc else 'AC',
+            'count': self.count,
+            'voltage_avg': self.voltage_sum / self.count,
+            'voltage_min': self.voltage_min,
+            'voltage_max': self.voltage_max,
+            'current_avg': self.current_sum / self.count,
+            'current_min': self.current_min,
+            'current_max': self.current_max,
+            'frequency_avg': self.frequency_sum / self.count,
+            'frequency_min': self.frequency_min,
+            'frequency_max': self.frequency_max,
+        }
+
+
 @dataclass
 class Limit(Base):
     __abstract__ = True
@@ -413,7 +680,7 @@ class Battery(Base):
             'id': self.id,
             'battery_specification_id': self.battery_specification_id,
             'plant_battery_system_id': self.plant_battery_system_id,
-            'sensor_readings': [s.id for s in self.plant_battery_system_sensor_readings],
+            # Le letture della batteria si chiedono con `include`.
             'name': self.name,
         }
 
@@ -513,7 +780,7 @@ class PlantModuleSystem(Base):
             'make': self.make,
             'ac_current_id': self.ac_current_id,
             'dc_current_id': self.dc_current_id,
-            'sensor_readings_ids': [s.id for s in self.plant_module_system_sensor_readings],
+            # Le letture del modulo si chiedono con `include`.
             'plant_id': self.plant.id if self.plant is not None else None
         }
 
@@ -622,8 +889,7 @@ class Plant(Base):
             'plant_battery_system_id': self.plant_battery_system_id,
             'plant_production_id': self.plant_production_id,
             'installer': self.installer,
-            'alarms': [a.id for a in self.alarms],
-            'tickets': [t.id for t in self.tickets],
+            # Allarmi e ticket dell'impianto si chiedono con `include`.
             'status': self.status
         }
 
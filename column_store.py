@@ -0,0 +1,287 @@
+import datetime
+import json
+import os
+import pathlib
+import threading
+from typing import Optional
+
+import numpy as np
+
+
+# Colonne dell'archivio e loro tipo. Ogni colonna di un dispositivo è un file
+# binario separato, con i valori uno dopo l'altro in ordine di timestamp.
+COLUMNS: dict[str, np.dtype] = {
+    'id': np.dtype('<i8'),
+    'timestamp': np.dtype('<i8'),
+    'voltage': np.dtype('<f4'),
+    'current': np.dtype('<f4'),
+    'frequency': np.dtype('<f4'),
+    'alarm_code': np.dtype('i1'),
+}
+
+# Grandezze misurate.
+FIELDS: tuple[str, ...] = ('voltage', 'current', 'frequency')
+
+EPOCH: datetime.datetime = datetime.datetime(1970, 1, 1)
+
+# File, nella directory dell'archivio, con la posizione dell'ultima
+# esportazione di ogni tabella di letture.
+EXPORT_STATE_FILE: str = 'export_state.json'
+
+# Letture lette dal database e aggiunte insieme all'archivio
+# dall'esportazione.
+EXPORT_CHUNK_SIZE: int = 10000
+
+
+def epoch_seconds(timestamp: datetime.datetime) -> int:
+    r"""Secondi dall'epoch di `timestamp` (naive, come nel database)."""
+    return int((timestamp.replace(tzinfo=None) - EPOCH).total_seconds())
+
+
+def isoformat(seconds: int) -> str:
+    r"""Timestamp nello stesso formato di `serialize` delle letture."""
+    timestamp: datetime.datetime = EPOCH + datetime.timedelta(seconds=int(seconds))
+    return timestamp.astimezone(datetime.timezone.utc).replace(tzinfo=None).isoformat(timespec='seconds') + 'Z'
+
+
+def alarm_code(code: Optional[str]) -> int:
+    r"""Codice allarme ('-01', '00', ..., '04') come intero."""
+    return int(code) if code is not None else -1
+
+
+class ColumnStore:
+    r"""Archivio a colonne dello storico delle letture dei sensori.
+
+        Le letture di ogni dispositivo sono salvate in
+        `<directory>/<tipo dispositivo>/<id>/<colonna>`: id della lettura e
+        timestamp (secondi dall'epoch) come int64, tensione, corrente e
+        frequenza come float32 e codice allarme come int8. I file vengono letti con `np.memmap`:
+        una finestra di tempo è una fetta delle mappe trovata con una
+        ricerca binaria sui timestamp, senza copie, e tutte le statistiche
+        sono calcolate con operazioni vettoriali di NumPy.
+
+        Le nuove letture vengono accodate ai file. Se arrivano letture più
+        vecchie dell'ultima salvata le colonne del dispositivo vengono
+        riscritte in ordine. Le letture con l'id di una già salvata vengono
+        scartate: esportare di nuovo le stesse letture (per esempio dopo
+        un'esportazione interrotta) non le duplica.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = pathlib.Path(directory)
+        self._maps: dict[tuple[str, int], dict[str, np.ndarray]] = {}
+        self._lock = threading.RLock()
+
+    def _path(self, device_type: str, device_id: int) -> pathlib.Path:
+        return self.directory / device_type / str(device_id)
+
+    def devices(self, device_type: str) -> list[int]:
+        path: pathlib.Path = self.directory / device_type
+        if not path.is_dir():
+            return []
+        return sorted(int(p.name) for p in path.iterdir() if p.name.isdigit())
+
+    def _columns(self, device_type: str, device_id: int) -> dict[str, np.ndarray]:
+        r"""Mappe in sola lettura delle colonne di un dispositivo."""
+        with self._lock:
+            maps: Optional[dict[str, np.ndarray]] = self._maps.get((device_type, device_id))
+            if maps is not None:
+                return maps
+
+            path: pathlib.Path = self._path(device_type, device_id)
+            sizes: dict[str, int] = {
+                name: (path / name).stat().st_size // dtype.itemsize if (path / name).exists() else 0
+                for name, dtype in COLUMNS.items()
+            }
+
+            # Dopo una scrittura interrotta le colonne possono avere lunghezze
+            # diverse: valgono solo le righe presenti in tutte.
+            length: int = min(sizes.values())
+            maps = {
+                name: np.memmap(path / name, dtype=dtype, mode='r', shape=(length,)) if length else np.empty(0, dtype=dtype)
+                for name, dtype in COLUMNS.items()
+            }
+            self._maps[(device_type, device_id)] = maps
+            return maps
+
+    def last_timestamp(self, device_type: str, device_id: int) -> Optional[int]:
+        timestamps: np.ndarray = self._columns(device_type, device_id)['timestamp']
+        return int(timestamps[-1]) if len(timestamps) else None
+
+    def export_cursor(self, name: str) -> Optional[tuple[datetime.datetime, int]]:
+        r"""Posizione dell'ultima esportazione della tabella `name` salvata
+            con `set_export_cursor`, o None.
+        """
+        path: pathlib.Path = self.directory / EXPORT_STATE_FILE
+        with self._lock:
+            if not path.exists():
+                return None
+            cursor: Optional[dict] = json.loads(path.read_text()).get(name)
+        if cursor is None:
+            return None
+        return datetime.datetime.fromisoformat(cursor['until']), cursor['last_id']
+
+    def set_export_cursor(self, name: str, until: datetime.datetime, last_id: int):
+        r"""Salva la posizione dell'esportazione della tabella `name`: sono
+            state esportate tutte le letture precedenti a `until` con id fino
+            a `last_id`.
+        """
+        path: pathlib.Path = self.directory / EXPORT_STATE_FILE
+        with self._lock:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            state: dict = json.loads(path.read_text()) if path.exists() else {}
+            state[name] = {'until': until.isoformat(), 'last_id': last_id}
+            path.with_suffix('.tmp').write_text(json.dumps(state, indent=4))
+            os.replace(path.with_suffix('.tmp'), path)
+
+    def append(self, device_type: str, device_id: int, columns: dict[str, np.ndarray]) -> int:
+        r"""Aggiunge le letture di un dispositivo, un array per colonna.
+            Ritorna il numero di letture aggiunte, senza quelle già salvate.
+        """
+        order: np.ndarray = np.argsort(columns['timestamp'], kind='stable')
+        new: dict[str, np.ndarray] = {
+            name: np.asarray(columns[name], dtype=dtype)[order] for name, dtype in COLUMNS.items()
+        }
+        if not len(order):
+            return 0
+
+        with self._lock:
+            path: pathlib.Path = self._path(device_type, device_id)
+            path.mkdir(parents=True, exist_ok=True)
+            current: dict[str, np.ndarray] = self._columns(device_type, device_id)
+            if len(current['timestamp']) and current['timestamp'][-1] >= new['timestamp'][0]:
+                # Una lettura già salvata ha lo stesso timestamp: basta
+                # cercare gli id da `new['timestamp'][0]` in poi.
+                start: int = int(np.searchsorted(current['timestamp'], new['timestamp'][0], 'left'))
+                saved: np.ndarray = np.isin(new['id'], current['id'][start:])
+                new = {name: column[~saved] for name, column in new.items()}
+                if not len(new['timestamp']):
+                    return 0
+            self._maps.pop((device_type, device_id), None)
+
+            if len(current['timestamp']) and current['timestamp'][-1] > new['timestamp'][0]:
+                # Letture in ritardo: riscrive le colonne in ordine.
+                merged_order: np.ndarray = np.argsort(
+                    np.concatenate((current['timestamp'], new['timestamp'])),
+                    kind='stable'
+                )
+                for name in COLUMNS:
+                    merged: np.ndarray = np.concatenate((current[name], new[name]))[merged_order]
+                    merged.tofile(path / f'{name}.tmp')
+                    os.replace(path / f'{name}.tmp', path / name)
+            else:
+                for name in COLUMNS:
+                    with open(path / name, 'ab') as f:
+                        # Scarta eventuali righe in più lasciate da una
+                        # scrittura interrotta.
+                        f.truncate(len(current[name]) * COLUMNS[name].itemsize)
+                        f.write(new[name].tobytes())
+        return len(new['timestamp'])
+
+    def window(self, device_type: str, device_id: int, since: Optional[datetime.datetime] = None, until: Optional[datetime.datetime] = None) -> dict[str, np.ndarray]:
+        r"""Colonne delle letture tra `since` e `until` inclusi: sono fette
+            delle mappe dei file, senza copie.
+        """
+        columns: dict[str, np.ndarray] = self._columns(device_type, device_id)
+        timestamps: np.ndarray = columns['timestamp']
+        start: int = int(np.searchsorted(timestamps, epoch_seconds(since), 'left')) if since is not None else 0
+        end: int = int(np.searchsorted(timestamps, epoch_seconds(until), 'right')) if until is not None else len(timestamps)
+        return {name: column[start:end] for name, column in columns.items()}
+
+    def stats(self, device_type: str, device_id: int, since: Optional[datetime.datetime] = None, until: Optional[datetime.datetime] = None) -> dict:
+        r"""Numero di letture, primo e ultimo timestamp e media, minimo,
+            massimo e deviazione standard di ogni grandezza nella finestra.
+        """
+        columns: dict[str, np.ndarray] = self.window(device_type, device_id, since, until)
+        count: int = len(columns['timestamp'])
+        result: dict = {
+            'count': count,
+            'first': isoformat(columns['timestamp'][0]) if count else None,
+            'last': isoformat(columns['timestamp'][-1]) if count else None,
+            'alarms': int(np.count_nonzero(columns['alarm_code'] != -1)),
+        }
+        for field in FIELDS:
+            values: np.ndarray = columns[field]
+            result[field] = {
+                # Le somme in float64 evitano la perdita di precisione dei
+                # float32 su milioni di letture.
+                'avg': float(values.mean(dtype=np.float64)) if count else None,
+                'min': float(values.min()) if count else None,
+                'max': float(values.max()) if count else None,
+                'std': float(values.std(dtype=np.float64)) if count else None,
+            }
+        return result
+
+    def resample(self, device_type: str, device_id: int, seconds: int, aggregates: tuple[str, ...] = ('avg',), since: Optional[datetime.datetime] = None, until: Optional[datetime.datetime] = None) -> dict[str, np.ndarray]:
+        r"""Letture della finestra raggruppate in intervalli di `seconds`
+            secondi allineati all'epoch. Ritorna un array per colonna:
+            `timestamp` (inizio dell'intervallo), `count` e
+            `<grandezza>_<aggregazione>` per le aggregazioni richieste
+            (avg, min, max, sum). Gli intervalli senza letture non ci sono.
+        """
+        columns: dict[str, np.ndarray] = self.window(device_type, device_id, since, until)
+        buckets: np.ndarray = columns['timestamp'] // seconds * seconds
+        if not len(buckets):
+            return {'timestamp': buckets, 'count': np.empty(0, dtype=np.int64)}
+
+        # Le letture sono ordinate: ogni intervallo è un tratto contiguo.
+        starts: np.ndarray = np.concatenate(([0], np.flatnonzero(np.diff(buckets)) + 1))
+        counts: np.ndarray = np.diff(np.append(starts, len(buckets)))
+        result: dict[str, np.ndarray] = {'timestamp': buckets[starts], 'count': counts}
+        for field in FIELDS:
+            values: np.ndarray = columns[field]
+            for aggregate in aggregates:
+                if aggregate == 'avg':
+                    result[f'{field}_avg'] = np.add.reduceat(values, starts, dtype=np.float64) / counts
+                elif aggregate == 'sum':
+                    result[f'{field}_sum'] = np.add.reduceat(values, starts, dtype=np.float64)
+                elif aggregate == 'min':
+                    result[f'{field}_min'] = np.minimum.reduceat(values, starts)
+                elif aggregate == 'max':
+                    result[f'{field}_max'] = np.maximum.reduceat(values, starts)
+        return result
+
+    def threshold_scan(self, device_type: str, device_id: int, field: str, lower: Optional[float] = None, upper: Optional[float] = None, since: Optional[datetime.datetime] = None, until: Optional[datetime.datetime] = None) -> list[dict]:
+        r"""Tratti consecutivi di letture con `field` fuori da `lower` e
+            `upper` (esclusi): per ognuno inizio, fine, numero di letture e
+            valori minimo e massimo.
+        """
+        columns: dict[str, np.ndarray] = self.window(device_type, device_id, since, until)
+        values: np.ndarray = columns[field]
+        outside: np.ndarray = np.zeros(len(values), dtype=bool)
+        if lower is not None:
+            outside |= values < lower
+        if upper is not None:
+            outside |= values > upper
+
+        edges: np.ndarray = np.diff(outside.astype(np.int8), prepend=0, append=0)
+        starts: np.ndarray = np.flatnonzero(edges == 1)
+        ends: np.ndarray = np.flatnonzero(edges == -1)
+        if not len(starts):
+            return []
+
+        # `reduceat` su indici alternati inizio/fine: i risultati di posto
+        # pari sono quelli dei tratti.
+        indices: np.ndarray = np.empty(2 * len(starts), dtype=np.int64)
+        indices[0::2] = starts
+        indices[1::2] = ends
+        if indices[-1] == len(values):
+            indices = indices[:-1]
+        minimums: np.ndarray = np.minimum.reduceat(values, indices)[0::2]
+        maximums: np.ndarray = np.maximum.reduceat(values, indices)[0::2]
+
+        timestamps: np.ndarray = columns['timestamp']
+        return [
+            {
+                'start': isoformat(timestamps[s]),
+                'end': isoformat(timestamps[e - 1]),
+                'count': int(e - s),
+                'min': float(lo),
+                'max': float(hi),
+            }
+            for s, e, lo, hi in zip(starts, ends, minimums, maximums)
+        ]
+
+    def invalidate(self):
+        with self._lock:
+            self._maps.clear()
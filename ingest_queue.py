@@ -0,0 +1,137 @@
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable
+
+
+class WriteBehindQueue:
+    r"""Coda di scrittura differita (write-behind) per le letture dei sensori.
+
+        Le richieste HTTP mettono in coda le letture già validate e
+        rispondono subito. Un thread in background svuota la coda e scrive le
+        letture a gruppi (group commit): un gruppo viene scritto quando
+        raggiunge `max_batch_size` elementi oppure quando sono passati
+        `max_delay` secondi dal primo elemento del gruppo.
+
+        `write_batch` ritorna il numero di elementi scritti: gli altri
+        (scartati dalla scrittura) sono contati tra quelli falliti.
+    """
+
+    def __init__(self, write_batch: Callable[[list], int], max_batch_size: int = 500, max_delay: float = 0.5, max_depth: int = 100000):
+        self.write_batch = write_batch
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+
+        self._queue: queue.Queue = queue.Queue(maxsize=max_depth)
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+
+        # Statistiche.
+        self._enqueued: int = 0
+        self._written: int = 0
+        self._failed: int = 0
+        self._rejected: int = 0
+        self._batches: int = 0
+        self._last_batch_size: int = 0
+        self._last_batch_seconds: float = 0.0
+
+    def start(self) -> 'WriteBehindQueue':
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+            self._thread.start()
+        return self
+
+    def put(self, item: Any) -> bool:
+        r"""Mette in coda una lettura. Ritorna `False` se la coda è piena o se
+            la coda è in chiusura.
+        """
+        if self._stop.is_set():
+            return False
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            with self._lock:
+                self._rejected += 1
+            return False
+        with self._lock:
+            self._enqueued += 1
+        return True
+
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'depth': self.depth(),
+                'max_depth': self._queue.maxsize,
+                'max_batch_size': self.max_batch_size,
+                'max_delay': self.max_delay,
+                'running': self._thread is not None and self._thread.is_alive(),
+                'enqueued': self._enqueued,
+                'written': self._written,
+                'failed': self._failed,
+                'rejected': self._rejected,
+                'batches': self._batches,
+                'last_batch_size': self._last_batch_size,
+                'last_batch_seconds': self._last_batch_seconds,
+            }
+
+    def flush(self):
+        r"""Attende che tutte le letture in coda siano state scritte."""
+        self._queue.join()
+
+    def stop(self, timeout: float | None = None):
+        r"""Ferma il thread di scrittura dopo aver scritto le letture rimaste
+            in coda. Da chiamare allo spegnimento del server.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _next_batch(self) -> list:
+        try:
+            batch: list = [self._queue.get(timeout=self.max_delay)]
+        except queue.Empty:
+            return []
+
+        deadline: float = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch_size:
+            remaining: float = deadline - time.monotonic()
+            try:
+                if remaining <= 0 or self._stop.is_set():
+                    # Prendi solo quello che è già in coda.
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _run(self):
+        while not (self._stop.is_set() and self._queue.empty()):
+            batch = self._next_batch()
+            if not batch:
+                continue
+
+            start: float = time.monotonic()
+            try:
+                written: int = self.write_batch(batch)
+                with self._lock:
+                    self._written += written
+                    self._failed += len(batch) - written
+            except Exception as e:
+                logging.error(f'write-behind: could not write {len(batch)} readings: {str(e)}')
+                with self._lock:
+                    self._failed += len(batch)
+            finally:
+                with self._lock:
+                    self._batches += 1
+                    self._last_batch_size = len(batch)
+                    self._last_batch_seconds = time.monotonic() - start
+                for _ in batch:
+                    self._queue.task_done()
@@ -0,0 +1,123 @@
+import datetime
+import logging
+import threading
+import time
+from typing import Any, Callable
+
+
+class ScheduledJob:
+    r"""Un job periodico con le sue metriche.
+
+        Un'esecuzione del job non parte mai se la precedente è ancora in
+        corso (per esempio una chiamata manuale mentre il job schedulato sta
+        girando): in quel caso l'esecuzione viene saltata e conteggiata in
+        `skipped`.
+    """
+
+    def __init__(self, job_id: str, func: Callable[[], Any], seconds: float):
+        self.job_id = job_id
+        self.func = func
+        self.seconds = seconds
+
+        self._running = threading.Lock()
+        self._lock = threading.Lock()
+
+        # Metriche.
+        self._runs: int = 0
+        self._failures: int = 0
+        self._skipped: int = 0
+        self._last_started: datetime.datetime | None = None
+        self._last_duration: float | None = None
+        self._max_duration: float = 0.0
+        self._total_duration: float = 0.0
+        self._last_result: Any = None
+        self._last_error: str | None = None
+
+    def run(self) -> bool:
+        r"""Esegue il job. Ritorna `False` se un'altra esecuzione è in corso."""
+        if not self._running.acquire(blocking=False):
+            logging.warning(f'job {self.job_id}: previous run still in progress, skipping')
+            with self._lock:
+                self._skipped += 1
+            return False
+
+        started: datetime.datetime = datetime.datetime.now(datetime.timezone.utc)
+        start: float = time.monotonic()
+        result: Any = None
+        error: str | None = None
+        try:
+            result = self.func()
+        except Exception as e:
+            error = str(e)
+            logging.error(f'job {self.job_id}: {error}')
+        finally:
+            duration: float = time.monotonic() - start
+            with self._lock:
+                self._runs += 1
+                if error is not None:
+                    self._failures += 1
+                self._last_started = started
+                self._last_duration = duration
+                self._max_duration = max(self._max_duration, duration)
+                self._total_duration += duration
+                self._last_result = result
+                self._last_error = error
+            self._running.release()
+
+        return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'id': self.job_id,
+                'interval_seconds': self.seconds,
+                'running': self._running.locked(),
+                'runs': self._runs,
+                'failures': self._failures,
+                'skipped': self._skipped,
+                'last_started': self._last_started.isoformat() if self._last_started is not None else None,
+                'last_duration_seconds': self._last_duration,
+                'max_duration_seconds': self._max_duration,
+                'mean_duration_seconds': self._total_duration / self._runs if self._runs else None,
+                'last_result': self._last_result,
+                'last_error': self._last_error,
+            }
+
+
+class JobRegistry:
+    r"""Registro dei job di manutenzione (chiusura automatica dei ticket,
+        `ANALYZE`, ...) eseguiti da APScheduler a intervalli regolari.
+
+        Ogni job viene registrato nello scheduler con `max_instances=1` e
+        `coalesce=True`: se un'esecuzione dura più dell'intervallo, le
+        esecuzioni perse vengono accorpate in una sola invece di accumularsi.
+    """
+
+    def __init__(self, scheduler: Any):
+        self.scheduler = scheduler
+        self._jobs: dict[str, ScheduledJob] = {}
+
+    def add(self, job_id: str, func: Callable[[], Any], seconds: float) -> ScheduledJob:
+        job = ScheduledJob(job_id, func, seconds)
+        self._jobs[job_id] = job
+        if seconds > 0:
+            self.scheduler.add_job(
+                id=job_id,
+                func=job.run,
+                trigger='interval',
+                seconds=seconds,
+                max_instances=1,
+                coalesce=True,
+                replace_existing=True,
+            )
+        return job
+
+    def run(self, job_id: str) -> bool:
+        r"""Esegue subito un job, al di fuori dello scheduler."""
+        return self._jobs[job_id].run()
+
+    def __contains__(self, job_id: str) -> bool:
+        return job_id in self._jobs
+
+    def stats(self) -> list[dict]:
+        return [job.stats() for job in self._jobs.values()]
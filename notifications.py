@@ -0,0 +1,170 @@
+import concurrent.futures
+import logging
+import threading
+import time
+from typing import Any, Callable
+
+
+class NotificationDispatcher:
+    r"""Invio asincrono delle notifiche (per esempio con apprise).
+
+        I messaggi pubblicati con `publish` non vengono inviati subito: i
+        messaggi con la stessa chiave (l'impianto) arrivati entro
+        `coalesce_delay` secondi dal primo vengono accorpati in un solo
+        riepilogo. I riepiloghi vengono inviati da un pool di thread, con
+        `max_retries` nuovi tentativi in caso di errore e attesa esponenziale
+        (`backoff`, `2 * backoff`, ...) tra un tentativo e l'altro.
+
+        `publish` non blocca mai: se ci sono già `max_pending` messaggi in
+        attesa il messaggio viene scartato.
+    """
+
+    def __init__(self, send: Callable[[str, str], bool], coalesce_delay: float = 5.0, max_workers: int = 2, max_retries: int = 3, backoff: float = 1.0, max_pending: int = 10000):
+        # `send(title, body)` ritorna `True` se l'invio è riuscito.
+        self.send = send
+        self.coalesce_delay = coalesce_delay
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_pending = max_pending
+
+        self._pending: dict[Any, list[str]] = {}
+        self._deadlines: dict[Any, float] = {}
+        self._pending_count: int = 0
+        self._in_flight: int = 0
+        self._stop = threading.Event()
+        self._cond = threading.Condition()
+        self._thread: threading.Thread | None = None
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='notify')
+
+        # Statistiche.
+        self._published: int = 0
+        self._dropped: int = 0
+        self._digests: int = 0
+        self._sent: int = 0
+        self._failed: int = 0
+        self._retries: int = 0
+
+    def start(self) -> 'NotificationDispatcher':
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='notify-coalesce', daemon=True)
+            self._thread.start()
+        return self
+
+    def publish(self, key: Any, message: str) -> bool:
+        with self._cond:
+            if self._stop.is_set() or self._pending_count >= self.max_pending:
+                self._dropped += 1
+                return False
+            if key not in self._pending:
+                self._pending[key] = []
+                self._deadlines[key] = time.monotonic() + self.coalesce_delay
+            self._pending[key].append(message)
+            self._pending_count += 1
+            self._published += 1
+            self._cond.notify()
+        return True
+
+    def depth(self) -> int:
+        r"""Messaggi in attesa più riepiloghi in fase di invio."""
+        with self._cond:
+            return self._pending_count + self._in_flight
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                'depth': self._pending_count + self._in_flight,
+                'pending_messages': self._pending_count,
+                'pending_plants': len(self._pending),
+                'in_flight': self._in_flight,
+                'published': self._published,
+                'dropped': self._dropped,
+                'digests': self._digests,
+                'sent': self._sent,
+                'failed': self._failed,
+                'retries': self._retries,
+            }
+
+    def flush(self, timeout: float | None = None) -> bool:
+        r"""Invia subito tutti i messaggi in attesa e aspetta la fine degli
+            invii. Ritorna `False` se il timeout è scaduto.
+        """
+        deadline: float | None = time.monotonic() + timeout if timeout is not None else None
+        with self._cond:
+            now: float = time.monotonic()
+            for key in self._deadlines:
+                self._deadlines[key] = now
+            self._cond.notify_all()
+            while self._pending_count or self._in_flight:
+                remaining: float | None = deadline - time.monotonic() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def stop(self, timeout: float | None = None):
+        r"""Invia i messaggi rimasti e ferma i thread. Da chiamare allo
+            spegnimento del server.
+        """
+        self.flush(timeout)
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self._executor.shutdown(wait=False)
+
+    def _due(self) -> list[tuple[Any, list[str]]]:
+        now: float = time.monotonic()
+        due: list[tuple[Any, list[str]]] = []
+        for key, deadline in list(self._deadlines.items()):
+            if deadline <= now:
+                messages = self._pending.pop(key)
+                del self._deadlines[key]
+                self._pending_count -= len(messages)
+                self._in_flight += 1
+                due.append((key, messages))
+        return due
+
+    def _run(self):
+        while not self._stop.is_set():
+            with self._cond:
+                due = self._due()
+                if not due:
+                    timeout: float | None = None
+                    if self._deadlines:
+                        timeout = max(0.0, min(self._deadlines.values()) - time.monotonic())
+                    self._cond.wait(timeout)
+                    continue
+                self._digests += len(due)
+
+            for key, messages in due:
+                self._executor.submit(self._deliver, key, messages)
+
+    def _deliver(self, key: Any, messages: list[str]):
+        title: str = f'fv-pgt: impianto {key}, {len(messages)} notifiche'
+        body: str = '\n'.join(messages)
+        ok: bool = False
+        try:
+            for attempt in range(self.max_retries + 1):
+                if attempt:
+                    with self._cond:
+                        self._retries += 1
+                    time.sleep(self.backoff * 2 ** (attempt - 1))
+                try:
+                    ok = bool(self.send(title, body))
+                except Exception as e:
+                    logging.error(f'notification for plant {key} failed: {str(e)}')
+                    ok = False
+                if ok:
+                    break
+        finally:
+            with self._cond:
+                self._in_flight -= 1
+                if ok:
+                    self._sent += 1
+                else:
+                    self._failed += 1
+                self._cond.notify_all()
+        if not ok:
+            logging.error(f'notification for plant {key} dropped after {self.max_retries + 1} attempts')
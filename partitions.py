@@ -0,0 +1,224 @@
+import datetime
+import re
+import threading
+from typing import Any, Callable, Optional
+
+from sqlalchemy import Index, MetaData, Table, select, text
+
+
+# Numero di giorni di ogni periodo di partizionamento.
+PERIODS: dict[str, int] = {
+    'day': 1,
+    'week': 7,
+}
+
+# Le partizioni settimanali iniziano di lunedì: il 5 gennaio 1970 è il primo
+# lunedì dopo l'epoch.
+EPOCH: datetime.date = datetime.date(1970, 1, 5)
+
+# Gli id delle letture in una partizione iniziano da `chiave << ID_SHIFT`:
+# sono unici tra tutte le partizioni e dall'id si ricava la partizione.
+ID_SHIFT: int = 32
+
+
+def naive(timestamp: datetime.datetime) -> datetime.datetime:
+    return timestamp.replace(tzinfo=None)
+
+
+class ReadingPartitions:
+    r"""Tabelle delle letture dei sensori partizionate per periodo.
+
+        Le letture di ogni giorno (o settimana) sono scritte in una tabella
+        separata con le stesse colonne di `base_table`, per esempio
+        `plant_module_system_sensor_readings_20240101`. Le tabelle vengono
+        create alla prima lettura del periodo.
+
+        Le letture di un intervallo di tempo interrogano solo le partizioni
+        che si sovrappongono all'intervallo, per cui la latenza non dipende
+        dalla quantità di storico. Cancellare lo storico più vecchio
+        (`drop_before`) è un `DROP TABLE` per partizione, senza `DELETE` riga
+        per riga.
+
+        Le letture scritte prima di attivare il partizionamento restano in
+        `base_table`, che viene letta come la partizione più vecchia: non
+        ha un periodo, per cui viene letta con qualunque intervallo.
+
+        L'elenco delle partizioni esistenti è tenuto in memoria e riletto da
+        `sqlite_master` dopo `invalidate` (da chiamare dopo un rollback, che
+        può annullare la creazione di una partizione).
+    """
+
+    def __init__(self, base_table: Table, device_column: str, period: str = 'day'):
+        self.base_table = base_table
+        self.device_column = device_column
+        self.period = period
+        self.days: int = PERIODS[period]
+
+        self._metadata = MetaData()
+        self._name_pattern = re.compile(rf'^{re.escape(base_table.name)}_(\d{{8}})$')
+        self._tables: dict[int, Table] = {}
+        self._loaded: bool = False
+        self._lock = threading.RLock()
+
+    def key(self, timestamp: datetime.datetime) -> int:
+        r"""Chiave della partizione di `timestamp`."""
+        return (naive(timestamp).date().toordinal() - EPOCH.toordinal()) // self.days
+
+    def start(self, key: int) -> datetime.datetime:
+        r"""Inizio (incluso) del periodo della partizione `key`."""
+        day = datetime.date.fromordinal(EPOCH.toordinal() + key * self.days)
+        return datetime.datetime.combine(day, datetime.time())
+
+    def table_name(self, key: int) -> str:
+        return f'{self.base_table.name}_{self.start(key):%Y%m%d}'
+
+    def _table(self, key: int) -> Table:
+        name: str = self.table_name(key)
+        table: Optional[Table] = self._metadata.tables.get(name)
+        if table is None:
+            table = Table(
+                name,
+                self._metadata,
+                *[column._copy() for column in self.base_table.columns],
+                Index(f'ix_{name}_device_timestamp', self.device_column, 'timestamp'),
+                sqlite_autoincrement=True,
+            )
+        return table
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded = False
+
+    def _ensure_loaded(self, connection: Any):
+        if self._loaded:
+            return
+        self._tables.clear()
+        names = connection.execute(text("SELECT name FROM sqlite_master WHERE type = 'table'")).scalars()
+        for name in names:
+            match = self._name_pattern.match(name)
+            if match is None:
+                continue
+            key: int = self.key(datetime.datetime.strptime(match.group(1), '%Y%m%d'))
+            self._tables[key] = self._table(key)
+        self._loaded = True
+
+    def keys(self, connection: Any) -> list[int]:
+        with self._lock:
+            self._ensure_loaded(connection)
+            return sorted(self._tables)
+
+    def _ensure(self, connection: Any, key: int) -> Table:
+        with self._lock:
+            self._ensure_loaded(connection)
+            table: Optional[Table] = self._tables.get(key)
+            if table is None:
+                table = self._table(key)
+                table.create(connection, checkfirst=True)
+
+                # Gli id della partizione partono da `key << ID_SHIFT`.
+                connection.execute(
+                    text(
+                        'INSERT INTO sqlite_sequence (name, seq) '
+                        'SELECT :name, :seq '
+                        'WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = :name)'
+                    ),
+                    {'name': table.name, 'seq': key << ID_SHIFT}
+                )
+                self._tables[key] = table
+            return table
+
+    def insert(self, connection: Any, rows: list[dict]) -> list[int]:
+        r"""Scrive le letture (dizionari colonna-valore, senza id) nelle
+            partizioni dei loro timestamp. Ritorna gli id, nello stesso
+            ordine di `rows`.
+        """
+        groups: dict[int, list[int]] = {}
+        for i, row in enumerate(rows):
+            groups.setdefault(self.key(row['timestamp']), []).append(i)
+
+        ids: list[int] = [0] * len(rows)
+        for key, positions in groups.items():
+            table: Table = self._ensure(connection, key)
+            result = connection.execute(
+                table.insert().returning(table.c.id, sort_by_parameter_order=True),
+                [rows[i] for i in positions]
+            )
+            for i, reading_id in zip(positions, result.scalars()):
+                ids[i] = reading_id
+        return ids
+
+    def tables(self, connection: Any, since: Optional[datetime.datetime] = None, until: Optional[datetime.datetime] = None) -> list[Table]:
+        r"""Partizioni, in ordine di tempo, che si sovrappongono all'intervallo
+            tra `since` e `until` inclusi, precedute da `base_table`.
+        """
+        keys: list[int] = self.keys(connection)
+        if since is not None:
+            keys = [k for k in keys if k >= self.key(since)]
+        if until is not None:
+            keys = [k for k in keys if k <= self.key(until)]
+        return [self.base_table] + [self._table(key) for key in keys]
+
+    def select(self, connection: Any, device_id: Optional[int] = None, since: Optional[datetime.datetime] = None, until: Optional[datetime.datetime] = None, limit: Optional[int] = None, newest_first: bool = False, columns: Optional[Callable[[Table], list]] = None) -> list:
+        r"""Letture di un dispositivo (o di tutti se `device_id` è `None`) tra
+            `since` e `until` inclusi, leggendo solo le partizioni che si
+            sovrappongono all'intervallo. Con `newest_first` le letture sono
+            in ordine decrescente di timestamp e, se c'è un `limit`, le
+            partizioni più vecchie non vengono lette appena si raggiunge il
+            limite. `columns`, se indicato, ritorna le colonne da leggere da
+            ogni partizione (di default tutte).
+        """
+        return list(self.iterate(connection, device_id, since, until, limit, newest_first, columns))
+
+    def iterate(self, connection: Any, device_id: Optional[int] = None, since: Optional[datetime.datetime] = None, until: Optional[datetime.datetime] = None, limit: Optional[int] = None, newest_first: bool = False, columns: Optional[Callable[[Table], list]] = None, yield_per: Optional[int] = None):
+        r"""Come `select`, ma ritorna le letture una alla volta: le partizioni
+            vengono interrogate solo quando le precedenti sono finite e con
+            `yield_per` le righe di ogni partizione vengono lette dal
+            database a gruppi.
+        """
+        tables: list[Table] = self.tables(connection, since, until)
+        if newest_first:
+            tables.reverse()
+
+        count: int = 0
+        for table in tables:
+            query = select(*columns(table)) if columns is not None else select(table)
+            if device_id is not None:
+                query = query.where(table.c[self.device_column] == device_id)
+            if since is not None:
+                query = query.where(table.c.timestamp >= since)
+            if until is not None:
+                query = query.where(table.c.timestamp <= until)
+            if newest_first:
+                query = query.order_by(table.c.timestamp.desc())
+            if limit is not None:
+                query = query.limit(limit - count)
+            if yield_per is not None:
+                query = query.execution_options(yield_per=yield_per)
+            for row in connection.execute(query):
+                count += 1
+                yield row
+            if limit is not None and count >= limit:
+                break
+
+    def get(self, connection: Any, reading_id: int) -> Optional[Any]:
+        r"""Lettura con id `reading_id`: la partizione si ricava dall'id.
+            Gli id che non sono di nessuna partizione sono di `base_table`.
+        """
+        key: int = reading_id >> ID_SHIFT
+        table: Table = self._table(key) if key in self.keys(connection) else self.base_table
+        return connection.execute(select(table).where(table.c.id == reading_id)).first()
+
+    def drop_before(self, connection: Any, timestamp: datetime.datetime) -> list[str]:
+        r"""Cancella le partizioni che finiscono prima di `timestamp`. Ritorna
+            i nomi delle tabelle cancellate.
+        """
+        dropped: list[str] = []
+        with self._lock:
+            for key in self.keys(connection):
+                if self.start(key + 1) > naive(timestamp):
+                    break
+                table: Table = self._tables.pop(key)
+                table.drop(connection, checkfirst=True)
+                connection.execute(text('DELETE FROM sqlite_sequence WHERE name = :name'), {'name': table.name})
+                dropped.append(table.name)
+        return dropped
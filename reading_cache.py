@@ -0,0 +1,240 @@
+import bisect
+import collections
+import datetime
+import sys
+import threading
+from typing import Any, Hashable, Optional
+
+
+class RingBuffer:
+    r"""Buffer circolare di capacità fissa con le letture più recenti di un
+        dispositivo, in ordine di timestamp.
+
+        Le letture sono in due liste preallocate (chiavi e valori) con un
+        indice di testa: una lettura più recente dell'ultima viene scritta
+        al posto della più vecchia in O(1). Le letture in ritardo vengono
+        inserite al loro posto (raro, O(capacità)).
+
+        `evicted_until` è il timestamp più recente tra le letture del
+        dispositivo che non sono nel buffer (None se ci sono tutte): una
+        finestra di tempo che inizia dopo `evicted_until` è completa.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.evicted_until: Optional[datetime.datetime] = None
+        self._keys: list = [None] * capacity
+        self._items: list = [None] * capacity
+        self._head: int = 0
+        self._size: int = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _key(self, i: int) -> datetime.datetime:
+        return self._keys[(self._head + i) % self.capacity]
+
+    def _slice(self, start: int, end: int) -> list:
+        return [self._items[(self._head + i) % self.capacity] for i in range(start, end)]
+
+    def _evict(self, key: datetime.datetime):
+        if self.evicted_until is None or key > self.evicted_until:
+            self.evicted_until = key
+
+    def add(self, key: datetime.datetime, item: Any):
+        if self._size and key < self._key(self._size - 1):
+            self._insert(key, item)
+            return
+
+        position: int = (self._head + self._size) % self.capacity
+        if self._size == self.capacity:
+            self._evict(self._keys[self._head])
+            self._head = (self._head + 1) % self.capacity
+        else:
+            self._size += 1
+        self._keys[position] = key
+        self._items[position] = item
+
+    def _insert(self, key: datetime.datetime, item: Any):
+        keys: list = [self._key(i) for i in range(self._size)]
+        items: list = self._slice(0, self._size)
+        position: int = bisect.bisect_right(keys, key)
+        if self._size == self.capacity:
+            if position == 0:
+                # Più vecchia di tutte le letture nel buffer.
+                self._evict(key)
+                return
+            self._evict(keys.pop(0))
+            items.pop(0)
+            position -= 1
+        keys.insert(position, key)
+        items.insert(position, item)
+        self._fill(keys, items)
+
+    def _fill(self, keys: list, items: list):
+        self._size = len(keys)
+        self._head = 0
+        self._keys = keys + [None] * (self.capacity - self._size)
+        self._items = items + [None] * (self.capacity - self._size)
+
+    def latest(self, n: int) -> Optional[list]:
+        r"""Ultime `n` letture, o None se il buffer non le ha tutte."""
+        if n > self._size and self.evicted_until is not None:
+            return None
+        return self._slice(max(0, self._size - n), self._size)
+
+    def window(self, since: datetime.datetime, until: Optional[datetime.datetime] = None) -> Optional[list]:
+        r"""Letture tra `since` e `until` inclusi, o None se il buffer non le
+            ha tutte.
+        """
+        if self.evicted_until is not None and since <= self.evicted_until:
+            return None
+
+        def search(key: datetime.datetime, right: bool) -> int:
+            lo, hi = 0, self._size
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if self._key(mid) < key or (right and self._key(mid) == key):
+                    lo = mid + 1
+                else:
+                    hi = mid
+            return lo
+
+        return self._slice(search(since, False), search(until, True) if until is not None else self._size)
+
+
+class SensorReadingCache:
+    r"""Letture più recenti di ogni dispositivo (modulo impianto o batteria)
+        in memoria, in un `RingBuffer` di `depth` letture per dispositivo.
+
+        Le letture vengono aggiunte dopo il commit e il buffer di un
+        dispositivo viene riempito dal database alla prima richiesta
+        (`warm`). La
+        memoria totale, stimata dalla dimensione di una lettura serializzata,
+        è limitata a `max_bytes`: oltre il limite vengono scartati i buffer
+        dei dispositivi usati meno di recente, che verranno riletti dal
+        database se richiesti di nuovo.
+
+        Le richieste che il buffer non può soddisfare per intero (più letture
+        di quelle tenute o finestre che iniziano prima della lettura più
+        vecchia) ritornano None e vanno fatte al database.
+    """
+
+    def __init__(self, depth: int, max_bytes: int):
+        self.depth = depth
+        self.max_bytes = max_bytes
+
+        self._buffers: collections.OrderedDict[Hashable, RingBuffer] = collections.OrderedDict()
+        self._entry_bytes: int = 0
+
+        # Letture aggiunte ai dispositivi senza buffer, per dispositivo, e
+        # numero di `clear`: vedi `generation`.
+        self._generations: dict[Hashable, int] = {}
+        self._clears: int = 0
+        self._hits: int = 0
+        self._misses: int = 0
+        self._lock = threading.Lock()
+
+    def _entries(self) -> int:
+        return sum(len(b) for b in self._buffers.values())
+
+    def _enforce_budget(self):
+        if not self._entry_bytes:
+            return
+        max_entries: int = self.max_bytes // self._entry_bytes
+        entries: int = self._entries()
+        while entries > max_entries and len(self._buffers) > 1:
+            _, buffer = self._buffers.popitem(last=False)
+            entries -= len(buffer)
+
+    def _measure(self, item: Any):
+        if not self._entry_bytes:
+            self._entry_bytes = sys.getsizeof(item) + sum(sys.getsizeof(v) for v in item.values())
+
+    def generation(self, device: Hashable) -> tuple[int, int]:
+        r"""Da leggere prima di interrogare il database per `warm`: cambia
+            se arrivano letture del dispositivo o se la cache viene svuotata.
+        """
+        with self._lock:
+            return self._clears, self._generations.get(device, 0)
+
+    def add(self, device: Hashable, key: datetime.datetime, item: dict):
+        r"""Aggiunge una lettura già salvata nel database. Le letture dei
+            dispositivi senza buffer non vengono tenute: il buffer verrà
+            riempito dal database alla prima richiesta.
+        """
+        with self._lock:
+            buffer: Optional[RingBuffer] = self._buffers.get(device)
+            if buffer is None:
+                self._generations[device] = self._generations.get(device, 0) + 1
+                return
+            self._measure(item)
+            growing: bool = len(buffer) < buffer.capacity
+            buffer.add(key, item)
+            self._buffers.move_to_end(device)
+            if growing:
+                self._enforce_budget()
+
+    def warm(self, device: Hashable, readings: list[tuple[datetime.datetime, dict]], generation: tuple[int, int]):
+        r"""Riempie il buffer di un dispositivo con le sue ultime `depth`
+            letture del database, coppie (timestamp, lettura) in ordine di
+            timestamp. Se nel frattempo sono arrivate letture del dispositivo
+            (`generation` diversa) il buffer non viene riempito perché
+            potrebbe non contenerle.
+        """
+        buffer = RingBuffer(self.depth)
+        buffer._fill([k for k, _ in readings[-self.depth:]], [i for _, i in readings[-self.depth:]])
+        if len(readings) >= self.depth:
+            # Potrebbero esserci altre letture con lo stesso timestamp della
+            # più vecchia.
+            buffer.evicted_until = readings[-self.depth][0]
+
+        with self._lock:
+            if generation != (self._clears, self._generations.get(device, 0)):
+                return
+            if readings:
+                self._measure(readings[0][1])
+            self._buffers[device] = buffer
+            self._buffers.move_to_end(device)
+            self._enforce_budget()
+
+    def latest(self, device: Hashable, n: int) -> Optional[list]:
+        with self._lock:
+            return self._lookup(device, lambda b: b.latest(n))
+
+    def window(self, device: Hashable, since: datetime.datetime, until: Optional[datetime.datetime] = None) -> Optional[list]:
+        with self._lock:
+            return self._lookup(device, lambda b: b.window(since, until))
+
+    def _lookup(self, device: Hashable, query) -> Optional[list]:
+        buffer: Optional[RingBuffer] = self._buffers.get(device)
+        result: Optional[list] = query(buffer) if buffer is not None else None
+        if result is None:
+            self._misses += 1
+        else:
+            self._hits += 1
+            self._buffers.move_to_end(device)
+        return result
+
+    def contains(self, device: Hashable) -> bool:
+        with self._lock:
+            return device in self._buffers
+
+    def clear(self):
+        with self._lock:
+            self._buffers.clear()
+            self._generations.clear()
+            self._clears += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries: int = self._entries()
+            return {
+                'devices': len(self._buffers),
+                'entries': entries,
+                'depth': self.depth,
+                'estimated_bytes': entries * self._entry_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self._hits,
+                'misses': self._misses,
+            }
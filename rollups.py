@@ -0,0 +1,287 @@
+import datetime
+import itertools
+import re
+from typing import Any, Iterable, Optional
+
+from sqlalchemy import BigInteger, Integer, Table, and_, cast, delete, func, or_, select, type_coerce
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+import classes_orm
+
+
+# Risoluzioni degli aggregati, in secondi: 1 minuto, 15 minuti, 1 ora.
+RESOLUTIONS: tuple[int, ...] = (60, 900, 3600)
+
+# Grandezze aggregate.
+FIELDS: tuple[str, ...] = ('voltage', 'current', 'frequency')
+
+EPOCH: datetime.datetime = datetime.datetime(1970, 1, 1)
+
+# Unità di misura accettate nel parametro `bucket`, per esempio `15m` o `2h`.
+BUCKET_UNITS: dict[str, int] = {
+    's': 1,
+    'm': 60,
+    'h': 3600,
+    'd': 86400,
+    'w': 604800,
+}
+
+# Aggregazioni accettate nel parametro `agg`.
+AGGREGATES: tuple[str, ...] = ('avg', 'min', 'max', 'sum', 'count')
+
+# Letture lette dal database e aggregate insieme da `rebuild`.
+REBUILD_CHUNK_SIZE: int = 10000
+
+
+def bucket(timestamp: datetime.datetime, resolution: int) -> datetime.datetime:
+    r"""Inizio dell'intervallo di `resolution` secondi che contiene
+        `timestamp` (naive, come nel database).
+    """
+    seconds: int = int((timestamp.replace(tzinfo=None) - EPOCH).total_seconds())
+    return EPOCH + datetime.timedelta(seconds=seconds - seconds % resolution)
+
+
+def first_bucket(timestamp: datetime.datetime, resolution: int) -> datetime.datetime:
+    r"""Inizio del primo intervallo di `resolution` secondi che inizia da
+        `timestamp` in poi.
+    """
+    start: datetime.datetime = bucket(timestamp, resolution)
+    if start < timestamp.replace(tzinfo=None):
+        start += datetime.timedelta(seconds=resolution)
+    return start
+
+
+def aggregate(readings: Iterable[tuple], resolutions: tuple[int, ...] = RESOLUTIONS, starts: Optional[dict[int, datetime.datetime]] = None) -> list[dict]:
+    r"""Aggrega le letture, tuple `(device_type, device_id, timestamp,
+        voltage, current, frequency)`, per dispositivo, risoluzione,
+        intervallo e tipo di corrente (DC se la frequenza è 0.0). Con `starts` le letture precedenti a `starts[resolution]`
+        non vengono aggregate a quella risoluzione. Ritorna le righe da
+        passare a `upsert`.
+    """
+    aggregates: dict[tuple, dict] = {}
+    for device_type, device_id, timestamp, *values in readings:
+        values = [v if v is not None else 0.0 for v in values]
+        dc: bool = values[2] == 0.0
+        for resolution in resolutions:
+            if starts is not None and timestamp.replace(tzinfo=None) < starts[resolution]:
+                continue
+            key = (device_type, device_id, resolution, bucket(timestamp, resolution), dc)
+            row = aggregates.get(key)
+            if row is None:
+                row = {
+                    'device_type': device_type,
+                    'device_id': device_id,
+                    'resolution': resolution,
+                    'bucket': key[3],
+                    'dc': dc,
+                    'count': 0,
+                }
+                for field, value in zip(FIELDS, values):
+                    row[f'{field}_sum'] = 0.0
+                    row[f'{field}_min'] = value
+                    row[f'{field}_max'] = value
+                aggregates[key] = row
+            row['count'] += 1
+            for field, value in zip(FIELDS, values):
+                row[f'{field}_sum'] += value
+                if value < row[f'{field}_min']:
+                    row[f'{field}_min'] = value
+                if value > row[f'{field}_max']:
+                    row[f'{field}_max'] = value
+    return list(aggregates.values())
+
+
+def upsert(connection: Any, aggregates: list[dict]):
+    r"""Somma gli aggregati a quelli già presenti nel database, con un solo
+        `INSERT ... ON CONFLICT DO UPDATE`. Le letture in ritardo finiscono
+        semplicemente nel loro intervallo.
+    """
+    if not aggregates:
+        return
+
+    table = classes_orm.SensorReadingRollup.__table__
+    statement = sqlite_insert(table)
+    excluded = statement.excluded
+    values: dict = {'count': table.c.count + excluded.count}
+    for field in FIELDS:
+        values[f'{field}_sum'] = table.c[f'{field}_sum'] + excluded[f'{field}_sum']
+
+        # Con due argomenti `min` e `max` di SQLite sono funzioni scalari.
+        values[f'{field}_min'] = func.min(table.c[f'{field}_min'], excluded[f'{field}_min'])
+        values[f'{field}_max'] = func.max(table.c[f'{field}_max'], excluded[f'{field}_max'])
+
+    connection.execute(
+        statement.on_conflict_do_update(
+            index_elements=['device_type', 'device_id', 'resolution', 'bucket', 'dc'],
+            set_=values
+        ),
+        aggregates
+    )
+
+
+def rebuild(connection: Any, device_type: str, readings: Iterable[tuple], first: Optional[datetime.datetime] = None, chunk_size: int = REBUILD_CHUNK_SIZE) -> int:
+    r"""Ricostruisce gli aggregati di un tipo di dispositivo a partire dalle
+        letture, aggregate e scritte `chunk_size` alla volta: la memoria non
+        dipende dal numero di letture.
+
+        `first` è il timestamp della lettura più vecchia ancora presente:
+        vengono ricostruiti solo gli intervalli che iniziano da `first` in
+        poi, quelli precedenti contengono letture già cancellate dalla
+        retention e restano come sono. Senza `first` vengono ricostruiti
+        tutti. Ritorna il numero di letture aggregate.
+    """
+    Rollup = classes_orm.SensorReadingRollup
+    statement = delete(Rollup.__table__).where(Rollup.device_type == device_type)
+    starts: Optional[dict[int, datetime.datetime]] = None
+    if first is not None:
+        starts = {resolution: first_bucket(first, resolution) for resolution in RESOLUTIONS}
+        statement = statement.where(or_(*(
+            and_(Rollup.resolution == resolution, Rollup.bucket >= start)
+            for resolution, start in starts.items()
+        )))
+    connection.execute(statement)
+
+    count: int = 0
+    readings = iter(readings)
+    while chunk := list(itertools.islice(readings, chunk_size)):
+        upsert(connection, aggregate(chunk, starts=starts))
+        count += len(chunk)
+    return count
+
+
+def parse_bucket(value: str) -> int:
+    r"""Durata in secondi di un intervallo scritto come `<n><unità>`, per
+        esempio `30s`, `15m`, `2h`, `1d` o `1w`.
+    """
+    match = re.fullmatch(r'(\d+)([smhdw])', value.strip())
+    if match is None or int(match.group(1)) == 0:
+        raise ValueError(f'invalid bucket {value!r}: expecting a duration such as 15m, 2h or 1d')
+    return int(match.group(1)) * BUCKET_UNITS[match.group(2)]
+
+
+def parse_aggregates(value: str) -> tuple[str, ...]:
+    r"""Aggregazioni separate da virgola, per esempio `avg,min,max`."""
+    names: tuple[str, ...] = tuple(dict.fromkeys(n.strip() for n in value.split(',') if n.strip()))
+    invalid: list[str] = [n for n in names if n not in AGGREGATES]
+    if not names or invalid:
+        raise ValueError(f'invalid agg {value!r}: expecting a comma separated list of {", ".join(AGGREGATES)}')
+    return names
+
+
+def bucket_query(table: Table, device_column: str, device_ids: list[int], seconds: int, since: Optional[datetime.datetime] = None, until: Optional[datetime.datetime] = None, split_ac_dc: bool = False):
+    r"""Query che raggruppa le letture di `table` in intervalli di `seconds`
+        secondi allineati all'epoch, con conteggio, somma, minimo e massimo
+        di ogni grandezza. Con `split_ac_dc` le letture DC (frequenza 0.0 o
+        mancante) sono raggruppate separatamente da quelle AC.
+
+        Ogni riga ha `bucket` (secondi dall'epoch), `dc` (solo con
+        `split_ac_dc`), `count` e le colonne `<grandezza>_sum`, `_min` e
+        `_max`, come gli aggregati di `upsert`: le righe di più tabelle
+        (partizioni) si possono unire con `merge_buckets`.
+    """
+    # Il timestamp è salvato in microsecondi dall'epoch (`EpochTimestamp`).
+    start = (type_coerce(table.c.timestamp, BigInteger) // (seconds * 1000000) * seconds).label('bucket')
+    groups: list = [start]
+    if split_ac_dc:
+        groups.append((func.coalesce(table.c.frequency, 0.0) == 0.0).label('dc'))
+
+    columns: list = [*groups, func.count().label('count')]
+    for field in FIELDS:
+        # Come in `aggregate`, i valori mancanti contano come 0.0.
+        value = func.coalesce(table.c[field], 0.0)
+        columns.append(func.sum(value).label(f'{field}_sum'))
+        columns.append(func.min(value).label(f'{field}_min'))
+        columns.append(func.max(value).label(f'{field}_max'))
+
+    query = select(*columns).where(table.c[device_column].in_(device_ids))
+    if since is not None:
+        query = query.where(table.c.timestamp >= since)
+    if until is not None:
+        query = query.where(table.c.timestamp <= until)
+    return query.group_by(*groups)
+
+
+def rollup_resolution(seconds: int) -> Optional[int]:
+    r"""Risoluzione più grande degli aggregati che divide `seconds`: gli
+        intervalli di `seconds` secondi si possono calcolare dagli aggregati
+        a quella risoluzione. None se nessuna risoluzione lo divide.
+    """
+    for resolution in sorted(RESOLUTIONS, reverse=True):
+        if seconds % resolution == 0:
+            return resolution
+    return None
+
+
+def rollup_query(device_type: str, device_ids: list[int], resolution: int, seconds: int, since: Optional[datetime.datetime] = None, until: Optional[datetime.datetime] = None, split_ac_dc: bool = False):
+    r"""Come `bucket_query`, ma raggruppa in intervalli di `seconds`
+        secondi gli aggregati a `resolution` secondi (un divisore di
+        `seconds`, vedi `rollup_resolution`) invece delle letture. Vengono
+        letti gli aggregati che iniziano da `since` incluso a `until`
+        escluso: le righe hanno le stesse colonne di `bucket_query` e si
+        possono unire con `merge_buckets`.
+    """
+    Rollup = classes_orm.SensorReadingRollup
+
+    # `bucket` è salvato come testo 'YYYY-MM-DD HH:MM:SS.ffffff'.
+    start = (cast(func.strftime('%s', Rollup.bucket), Integer) // seconds * seconds).label('bucket')
+    groups: list = [start]
+    if split_ac_dc:
+        groups.append(Rollup.dc.label('dc'))
+
+    columns: list = [*groups, func.sum(Rollup.count).label('count')]
+    for field in FIELDS:
+        columns.append(func.sum(Rollup.__table__.c[f'{field}_sum']).label(f'{field}_sum'))
+        columns.append(func.min(Rollup.__table__.c[f'{field}_min']).label(f'{field}_min'))
+        columns.append(func.max(Rollup.__table__.c[f'{field}_max']).label(f'{field}_max'))
+
+    query = select(*columns).where(
+        Rollup.device_type == device_type,
+        Rollup.device_id.in_(device_ids),
+        Rollup.resolution == resolution
+    )
+    if since is not None:
+        query = query.where(Rollup.bucket >= since)
+    if until is not None:
+        query = query.where(Rollup.bucket < until)
+    return query.group_by(*groups)
+
+
+def merge_buckets(rows: Iterable[Any], aggregates: tuple[str, ...], split_ac_dc: bool = False) -> list[dict]:
+    r"""Unisce le righe di `bucket_query` (anche di tabelle diverse) e di
+        `rollup_query` e calcola le aggregazioni richieste. Ritorna un
+        dizionario per intervallo, in ordine di tempo, con il timestamp di
+        inizio dell'intervallo nello stesso formato di `serialize`.
+    """
+    merged: dict[tuple, dict] = {}
+    for row in rows:
+        row = row._mapping
+        key = (row['bucket'], split_ac_dc and bool(row['dc']))
+        current: Optional[dict] = merged.get(key)
+        if current is None:
+            merged[key] = dict(row)
+            continue
+        current['count'] += row['count']
+        for field in FIELDS:
+            current[f'{field}_sum'] += row[f'{field}_sum']
+            current[f'{field}_min'] = min(current[f'{field}_min'], row[f'{field}_min'])
+            current[f'{field}_max'] = max(current[f'{field}_max'], row[f'{field}_max'])
+
+    buckets: list[dict] = []
+    for key in sorted(merged):
+        row = merged[key]
+        start: datetime.datetime = EPOCH + datetime.timedelta(seconds=row['bucket'])
+        result: dict = {
+            'timestamp': start.astimezone(datetime.timezone.utc).replace(tzinfo=None).isoformat(timespec='seconds') + 'Z',
+        }
+        if split_ac_dc:
+            result['current_type'] = 'DC' if row['dc'] else 'AC'
+        if 'count' in aggregates:
+            result['count'] = row['count']
+        for field in FIELDS:
+            for aggregate in aggregates:
+                if aggregate == 'avg':
+                    result[f'{field}_avg'] = row[f'{field}_sum'] / row['count']
+                elif aggregate != 'count':
+                    result[f'{field}_{aggregate}'] = row[f'{field}_{aggregate}']
+        buckets.append(result)
+    return buckets
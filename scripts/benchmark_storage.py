@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+r"""Confronto tra il database in memoria e il database su file (WAL).
+
+    Per ogni modalità l'applicazione viene avviata in un processo separato
+    (la configurazione del database viene letta all'avvio) e usata con il
+    client di test di Flask, senza server HTTP: viene misurato il throughput
+    di inserimento delle letture dei sensori e la latenza delle letture.
+
+    Uso, dalla radice del repository:
+
+        python -m scripts.benchmark_storage --readings 5000 --reads 200
+"""
+
+import argparse
+import base64
+import datetime
+import json
+import logging
+import os
+import pathlib
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any
+
+
+ROOT: pathlib.Path = pathlib.Path(__file__).resolve().parent.parent
+TOKEN: str = 'benchmark-token'
+BASIC: dict = {'Authorization': 'Basic ' + base64.b64encode(b'admin0:password0').decode()}
+BEARER: dict = {'Authorization': f'Bearer {TOKEN}'}
+
+
+def post(client, url: str, data: Any, headers: dict | None = None):
+    response = client.post(url, data=json.dumps(data), headers=headers or {}, content_type='application/json')
+    if response.status_code not in (200, 201, 202):
+        raise RuntimeError(f'{url}: {response.status_code} {response.data[:200]!r}')
+    return response
+
+
+def setup(client):
+    post(client, '/token', {'api_token': TOKEN}, BASIC)
+    post(client, '/voltage_range', {'lower': 40, 'upper': 300})
+    post(client, '/current_range', {'lower': 10, 'upper': 20})
+    post(client, '/frequency_range', {'lower': 45, 'upper': 51})
+    post(client, '/daily_power_range', {'lower': 1, 'upper': 2})
+    post(client, '/monthly_power_range', {'lower': 1, 'upper': 2})
+    post(client, '/dc_current_system', {'voltage_range_id': 1, 'current_range_id': 1})
+    post(client, '/ac_current_system', {'voltage_range_id': 1, 'current_range_id': 1, 'frequency_range_id': 1})
+    post(client, '/plant_module_system', {'ac_current_id': 1, 'dc_current_id': 1, 'capacity': 3})
+    post(client, '/battery_specification', {'type': 'master', 'voltage_range_id': 1, 'current_range_id': 1, 'capacity': 3})
+    post(client, '/battery', {'name': 'b1', 'battery_specification_id': 1})
+    post(client, '/plant_battery_system', {'battery_ids': [1]})
+    post(client, '/plant_production', {'daily_kwh': 1, 'monthly_kwh': 1, 'daily_power_range_id': 1, 'monthly_power_range_id': 1})
+    post(client, '/owner', {'first_name': 'benchmark', 'last_name': 'benchmark'})
+    post(client, '/plant', {'name': 'benchmark', 'owner_id': 1, 'plant_module_system_id': 1, 'plant_battery_system_id': 1, 'plant_production_id': 1, 'installer': 'benchmark'})
+
+
+def gen_reading(i: int, alarm_ratio: float) -> dict:
+    timestamp = datetime.datetime.now() - datetime.timedelta(seconds=i)
+    return {
+        # Una parte delle letture è fuori range e crea allarmi.
+        'voltage': 1000 if random.random() < alarm_ratio else random.uniform(50, 290),
+        'current': random.uniform(11, 19),
+        'frequency': 0.0,
+        'timestamp': timestamp.isoformat(timespec='seconds'),
+        'plant_module_system_id': 1,
+        'alarm_code': '-01',
+    }
+
+
+def percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def run(readings: int, reads: int, alarm_ratio: float) -> dict:
+    r"""Eseguito nel processo figlio, con la modalità già impostata
+        nell'ambiente.
+    """
+    sys.path.insert(0, str(ROOT))
+    os.chdir(ROOT)
+    import app as app_module
+    logging.disable(logging.CRITICAL)
+
+    client = app_module.app.test_client()
+    setup(client)
+
+    random.seed(0)
+    data: list[dict] = [gen_reading(i, alarm_ratio) for i in range(readings)]
+    start: float = time.perf_counter()
+    for d in data:
+        post(client, '/plant_module_system_sensor_reading', d, BEARER)
+    ingest_seconds: float = time.perf_counter() - start
+
+    latencies: dict[str, list[float]] = {}
+    for url in ('/plant_module_system_sensor_reading/1', '/alarm', '/plant_module_system_sensor_reading?plant_id=1'):
+        latencies[url] = []
+        for _ in range(reads if '?' not in url else max(1, reads // 20)):
+            start = time.perf_counter()
+            response = client.get(url)
+            latencies[url].append(time.perf_counter() - start)
+            if response.status_code != 200:
+                raise RuntimeError(f'{url}: {response.status_code}')
+
+    return {
+        'readings': readings,
+        'ingest_seconds': ingest_seconds,
+        'ingest_per_second': readings / ingest_seconds,
+        'reads': {
+            url: {
+                'p50_ms': statistics.median(values) * 1000,
+                'p95_ms': percentile(values, 0.95) * 1000,
+            }
+            for url, values in latencies.items()
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark database in memoria vs su file (WAL).')
+    parser.add_argument('--readings', type=int, default=2000, help='letture da inserire')
+    parser.add_argument('--reads', type=int, default=200, help='richieste GET per endpoint')
+    parser.add_argument('--alarm-ratio', type=float, default=0.1, help='frazione di letture fuori range')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run(args.readings, args.reads, args.alarm_ratio)))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        modes: dict[str, dict] = {
+            'memory': {},
+            'file (WAL)': {'SQLITE_DATABASE_FILE': os.path.join(tmp, 'benchmark.db')},
+        }
+        results: dict[str, dict] = {}
+        for mode, env in modes.items():
+            environment = {k: v for k, v in os.environ.items() if k != 'SQLITE_DATABASE_FILE'} | env
+            output = subprocess.run(
+                [sys.executable, str(pathlib.Path(__file__).resolve()), '--child',
+                 '--readings', str(args.readings), '--reads', str(args.reads), '--alarm-ratio', str(args.alarm_ratio)],
+                env=environment,
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout
+            results[mode] = json.loads(output.strip().splitlines()[-1])
+
+    print(f'{"mode":<12} {"readings/s":>12}  ' + '  '.join(f'{url} p50/p95 (ms)' for url in results['memory']['reads']))
+    for mode, result in results.items():
+        reads = '  '.join(
+            f'{r["p50_ms"]:>8.2f} / {r["p95_ms"]:<8.2f}'.ljust(len(url) + len(' p50/p95 (ms)'))
+            for url, r in result['reads'].items()
+        )
+        print(f'{mode:<12} {result["ingest_per_second"]:>12.1f}  {reads}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+import logging
+from typing import Any
+
+from sqlalchemy import event
+
+
+# Profilo di pragma per il database SQLite su file:
+#
+# - journal_mode=WAL: le letture non bloccano le scritture e viceversa;
+# - synchronous=NORMAL: con WAL il database resta consistente anche dopo un
+#   crash, si possono perdere solo le ultime transazioni in caso di
+#   spegnimento improvviso del sistema;
+# - cache_size: negativo è in KiB (64 MiB per connessione);
+# - mmap_size: lettura del file tramite memory map (256 MiB);
+# - temp_store=MEMORY: tabelle e indici temporanei in memoria;
+# - busy_timeout: millisecondi di attesa se il database è bloccato da
+#   un'altra connessione.
+DEFAULT_PRAGMAS: dict[str, Any] = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -65536,
+    'mmap_size': 268435456,
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5000,
+}
+
+
+def sqlite_uri(database_file: str | None) -> str:
+    r"""URI del database: su file se `database_file` è impostato, altrimenti
+        in memoria.
+    """
+    if database_file:
+        return f'sqlite:///{database_file}'
+    return 'sqlite:///:memory:'
+
+
+def apply_sqlite_pragmas(engine: Any, pragmas: dict[str, Any]):
+    r"""Applica `pragmas` a ogni nuova connessione del pool di `engine`. Le
+        pragma di SQLite valgono per la singola connessione, per cui vanno
+        eseguite a ogni connessione e non una volta sola.
+    """
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f'PRAGMA {name}={value}')
+        finally:
+            cursor.close()
+
+    logging.info(f'SQLite pragmas: {pragmas}')
+
+
+# Conversione di ogni colonna delle letture dalla codifica precedente:
+# timestamp come testo 'YYYY-MM-DD HH:MM:SS.ffffff' e codice allarme come
+# stringa ('-01', '00', ...).
+LEGACY_READING_COLUMNS: dict[str, str] = {
+    'timestamp': "CAST(strftime('%s', timestamp) AS INTEGER) * 1000000 + CAST(substr(substr(timestamp, 21) || '000000', 1, 6) AS INTEGER)",
+    'alarm_code': 'CAST(alarm_code AS INTEGER)',
+}
+
+
+def migrate_sensor_reading_table(connection: Any, table: Any, null_frequency: bool = False) -> bool:
+    r"""Converte una tabella di letture creata con la codifica precedente
+        (timestamp `DATETIME` e codice allarme come stringa) in quella di
+        `table`: la tabella viene ricreata con le nuove colonne e gli stessi
+        id, con un solo `INSERT ... SELECT`. Con `null_frequency` le
+        frequenze 0.0 diventano NULL. Ritorna False se la tabella è già
+        nella nuova codifica.
+    """
+    types: dict[str, str] = {
+        row[1]: row[2].upper()
+        for row in connection.exec_driver_sql(f'PRAGMA table_info("{table.name}")').all()
+    }
+    if types.get('timestamp') != 'DATETIME':
+        return False
+
+    legacy: str = f'{table.name}_legacy'
+    indexes = connection.exec_driver_sql(
+        "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+        (table.name,)
+    ).scalars().all()
+    for index in indexes:
+        connection.exec_driver_sql(f'DROP INDEX "{index}"')
+    connection.exec_driver_sql(f'ALTER TABLE "{table.name}" RENAME TO "{legacy}"')
+    table.create(connection)
+
+    expressions: dict[str, str] = dict(LEGACY_READING_COLUMNS)
+    if null_frequency:
+        expressions['frequency'] = 'NULLIF(frequency, 0.0)'
+    names: list[str] = [c.name for c in table.columns]
+    connection.exec_driver_sql(
+        f'INSERT INTO "{table.name}" ({", ".join(names)}) '
+        f'SELECT {", ".join(expressions.get(n, n) for n in names)} FROM "{legacy}"'
+    )
+
+    # Le tabelle con AUTOINCREMENT (partizioni) mantengono il contatore degli
+    # id anche se sono vuote.
+    has_sequence: bool = connection.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE name = 'sqlite_sequence'"
+    ).first() is not None
+    if has_sequence and connection.exec_driver_sql(
+        'SELECT 1 FROM sqlite_sequence WHERE name = ?', (legacy,)
+    ).first() is not None:
+        connection.exec_driver_sql('DELETE FROM sqlite_sequence WHERE name = ?', (table.name,))
+        connection.exec_driver_sql('UPDATE sqlite_sequence SET name = ? WHERE name = ?', (table.name, legacy))
+    connection.exec_driver_sql(f'DROP TABLE "{legacy}"')
+    logging.info(f'migrated {table.name} to the compact sensor reading encoding')
+    return True
+
+
+def add_missing_columns(connection: Any, table: Any) -> list[str]:
+    r"""Aggiunge a una tabella già esistente (database su file) le colonne
+        di `table` che mancano, con `ALTER TABLE ... ADD COLUMN`, e crea gli
+        indici mancanti. Le colonne aggiunte devono ammettere NULL: ritorna
+        i loro nomi, i valori sono a carico del chiamante.
+    """
+    existing: set[str] = {
+        row[1] for row in connection.exec_driver_sql(f'PRAGMA table_info("{table.name}")').all()
+    }
+    if not existing:
+        return []
+
+    added: list[str] = []
+    for column in table.columns:
+        if column.name in existing:
+            continue
+        column_type: str = column.type.compile(dialect=connection.dialect)
+        connection.exec_driver_sql(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}')
+        added.append(column.name)
+
+    if added:
+        create_missing_indexes(connection, table)
+        logging.info(f'added columns {added} to {table.name}')
+    return added
+
+
+def drop_outdated_table(connection: Any, table: Any) -> bool:
+    r"""Cancella una tabella già esistente (database su file) a cui manca
+        una delle colonne di `table`, perché venga ricreata da `create_all`.
+        Solo per tabelle che si possono ricalcolare da altri dati: ritorna
+        True se la tabella è stata cancellata.
+    """
+    existing: set[str] = {
+        row[1] for row in connection.exec_driver_sql(f'PRAGMA table_info("{table.name}")').all()
+    }
+    missing: list[str] = [c.name for c in table.columns if c.name not in existing]
+    if not existing or not missing:
+        return False
+
+    connection.exec_driver_sql(f'DROP TABLE "{table.name}"')
+    logging.warning(f'dropped {table.name}, missing columns {missing}: it will be rebuilt')
+    return True
+
+
+def create_missing_indexes(connection: Any, table: Any) -> list[str]:
+    r"""Crea gli indici di `table` che mancano nel database: `create_all`
+        non li aggiunge alle tabelle già esistenti (database su file).
+        Ritorna i nomi degli indici creati.
+    """
+    existing: set[str] = {
+        row[1] for row in connection.exec_driver_sql(f'PRAGMA index_list("{table.name}")').all()
+    }
+    created: list[str] = []
+    for index in table.indexes:
+        if index.name not in existing:
+            index.create(connection)
+            created.append(index.name)
+    if created:
+        logging.info(f'created indexes {created} on {table.name}')
+    return created
@@ -0,0 +1,169 @@
+r"""Test del motore di correlazione degli allarmi
+    (`alarm_engine.AlarmCorrelationEngine`) sui casi documentati in
+    `update_tickets` di `app.py`: i gruppi per cui aprire un ticket devono
+    essere gli stessi della query SQL che il motore ha sostituito.
+
+    Uso, dalla radice del repository:
+
+        python -m unittest discover tests
+"""
+
+import datetime
+import pathlib
+import sys
+import unittest
+
+from sqlalchemy import and_, create_engine, func, select
+from sqlalchemy.orm import Session
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+import alarm_engine
+import classes_orm
+
+
+Alm = classes_orm.Alarm
+
+now: datetime.datetime = datetime.datetime(2024, 1, 1, 12, 0, 0)
+
+
+def minutes_ago(minutes: int) -> datetime.datetime:
+    return now - datetime.timedelta(minutes=minutes)
+
+
+def sql_groups(session: Session, now: datetime.datetime) -> list[tuple]:
+    r"""Gruppi di allarmi per cui aprire un ticket secondo la query SQL
+        usata da `update_tickets` prima del motore in memoria.
+    """
+    one_hour_ago: datetime.datetime = now - datetime.timedelta(hours=1)
+    select_data = select(
+        Alm.code,
+        Alm.description,
+        Alm.severity_level,
+        Alm.plant_id,
+        func.group_concat(Alm.id).label('alarm_ids')
+    )
+    group_by_data = [Alm.code, Alm.description, Alm.severity_level, Alm.plant_id, Alm.ticket_id]
+    subquery = (
+        select_data
+        .where(Alm.ticket_id.is_(None))
+        .group_by(*group_by_data)
+        .having(func.count().filter(Alm.timestamp >= one_hour_ago) >= 1)
+    ).subquery()
+    alarms_to_tickets = (
+        select_data
+        .where(
+            and_(
+                Alm.ticket_id.is_(None),
+                Alm.code == subquery.c.code,
+                Alm.description == subquery.c.description,
+                Alm.severity_level == subquery.c.severity_level,
+                Alm.plant_id == subquery.c.plant_id
+            )
+        )
+        .group_by(*group_by_data)
+        .having(func.count() >= 2)
+    )
+    return sorted(
+        ((code, description, severity_level, plant_id), sorted(int(i) for i in alarm_ids.split(',')))
+        for code, description, severity_level, plant_id, alarm_ids in session.execute(alarms_to_tickets).all()
+    )
+
+
+class TestAlarmCorrelationEngine(unittest.TestCase):
+    def setUp(self):
+        self.db = create_engine('sqlite:///:memory:')
+        classes_orm.Base.metadata.create_all(self.db)
+        self.session = Session(self.db)
+
+        # Come `load_unticketed_alarms` di `app.py`.
+        self.engine = alarm_engine.AlarmCorrelationEngine(
+            lambda: self.session.query(
+                Alm.id, Alm.code, Alm.description, Alm.severity_level, Alm.plant_id, Alm.timestamp,
+                Alm.occurrences, Alm.last_seen
+            ).filter(Alm.ticket_id.is_(None)).all()
+        )
+
+    def tearDown(self):
+        self.session.close()
+        self.db.dispose()
+
+    def alarm(self, timestamp: datetime.datetime, plant_id: int | None = 1, code: str = '00') -> Alm:
+        alarm = Alm(code=code, description='tensione fuori range', severity_level='medio', timestamp=timestamp, plant_id=plant_id)
+        self.session.add(alarm)
+        self.session.flush()
+        self.engine.add(alarm)
+        return alarm
+
+    def collect(self) -> list[tuple]:
+        r"""Gruppi del motore, dopo aver controllato che siano gli stessi
+            della query SQL.
+        """
+        expected: list[tuple] = sql_groups(self.session, now)
+        groups: list[tuple] = [(key, sorted(ids)) for key, ids in self.engine.collect(now)]
+        self.assertEqual(groups, expected)
+        return groups
+
+    def test_case_0_one_alarm_before_and_one_after_an_hour_ago(self):
+        a0 = self.alarm(minutes_ago(90))
+        a1 = self.alarm(minutes_ago(30))
+        self.assertEqual([ids for _, ids in self.collect()], [[a0.id, a1.id]])
+
+    def test_case_1_both_alarms_in_the_last_hour(self):
+        a0 = self.alarm(minutes_ago(40))
+        a1 = self.alarm(minutes_ago(20))
+        self.assertEqual([ids for _, ids in self.collect()], [[a0.id, a1.id]])
+
+    def test_case_2_both_alarms_older_than_an_hour(self):
+        self.alarm(minutes_ago(180))
+        self.alarm(minutes_ago(120))
+        self.assertEqual(self.collect(), [])
+
+    def test_case_3_one_alarm_older_than_an_hour(self):
+        self.alarm(minutes_ago(120))
+        self.assertEqual(self.collect(), [])
+
+    def test_case_4_one_alarm_in_the_last_hour(self):
+        self.alarm(minutes_ago(30))
+        self.assertEqual(self.collect(), [])
+
+    def test_groups_are_separate_and_alarms_without_plant_are_ignored(self):
+        a0 = self.alarm(minutes_ago(50), plant_id=1)
+        b0 = self.alarm(minutes_ago(40), plant_id=2)
+        self.alarm(minutes_ago(30), plant_id=1, code='01')
+        self.alarm(minutes_ago(20), plant_id=None)
+        self.alarm(minutes_ago(10), plant_id=None)
+        a1 = self.alarm(minutes_ago(5), plant_id=1)
+        b1 = self.alarm(minutes_ago(5), plant_id=2)
+        self.assertEqual([ids for _, ids in self.collect()], [[a0.id, a1.id], [b0.id, b1.id]])
+
+    def test_ticket_opens_when_the_second_alarm_arrives(self):
+        self.alarm(minutes_ago(30))
+        self.assertEqual(self.collect(), [])
+        self.alarm(minutes_ago(10))
+        self.assertEqual(len(self.collect()), 1)
+
+        # Gli allarmi del gruppo sono stati tolti dallo stato.
+        self.assertEqual(self.engine.collect(now), [])
+
+    def test_rebuild_from_database_at_startup(self):
+        for minutes in (90, 30):
+            self.session.add(Alm(code='00', description='tensione fuori range', severity_level='medio', timestamp=minutes_ago(minutes), plant_id=1))
+        self.session.commit()
+        self.assertEqual(len(self.collect()), 1)
+
+    def test_rebuild_from_database_after_rollback(self):
+        a0 = self.alarm(minutes_ago(30))
+        self.session.commit()
+
+        # L'allarme annullato dal rollback non deve aprire un ticket con a0.
+        self.alarm(minutes_ago(20))
+        self.session.rollback()
+        self.engine.invalidate()
+        self.assertEqual(self.collect(), [])
+
+        a2 = self.alarm(minutes_ago(10))
+        self.assertEqual([ids for _, ids in self.collect()], [[a0.id, a2.id]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+r"""Test dell'archivio a colonne (`column_store.ColumnStore`): letture
+    aggiunte in ordine, in ritardo e esportate di nuovo.
+
+    Uso, dalla radice del repository:
+
+        python -m unittest discover tests
+"""
+
+import pathlib
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+import column_store
+
+
+def readings(ids: list[int], timestamps: list[int], voltage: float = 230.0) -> dict:
+    return {
+        'id': ids,
+        'timestamp': timestamps,
+        'voltage': [voltage] * len(ids),
+        'current': [10.0] * len(ids),
+        'frequency': [50.0] * len(ids),
+        'alarm_code': [-1] * len(ids),
+    }
+
+
+class TestColumnStoreAppend(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = column_store.ColumnStore(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def window(self) -> dict:
+        return self.store.window('plant_module_system', 1)
+
+    def test_same_second_and_values_are_different_readings(self):
+        self.assertEqual(self.store.append('plant_module_system', 1, readings([1], [100])), 1)
+        self.assertEqual(self.store.append('plant_module_system', 1, readings([2], [100])), 1)
+        self.assertEqual(self.window()['id'].tolist(), [1, 2])
+
+    def test_readings_already_saved_are_skipped(self):
+        self.store.append('plant_module_system', 1, readings([1, 2, 3], [100, 101, 102]))
+        self.assertEqual(self.store.append('plant_module_system', 1, readings([2, 3, 4], [101, 102, 103])), 1)
+        self.assertEqual(self.window()['id'].tolist(), [1, 2, 3, 4])
+
+    def test_late_readings_are_merged_in_order(self):
+        self.store.append('plant_module_system', 1, readings([1, 2], [100, 200]))
+        self.assertEqual(self.store.append('plant_module_system', 1, readings([3, 4], [150, 50], voltage=1.0)), 2)
+        columns: dict = self.window()
+        self.assertEqual(columns['timestamp'].tolist(), [50, 100, 150, 200])
+        self.assertEqual(columns['id'].tolist(), [4, 1, 3, 2])
+        self.assertTrue(np.array_equal(columns['voltage'], np.array([1.0, 230.0, 1.0, 230.0], dtype=np.float32)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,211 @@
+r"""Test delle notifiche dei ticket (`notifications.NotificationDispatcher`)
+    con apprise e un target `json://` locale: un server HTTP nello stesso
+    processo che registra le notifiche ricevute.
+
+    Uso, dalla radice del repository:
+
+        python -m unittest discover tests
+"""
+
+import base64
+import datetime
+import http.server
+import json
+import pathlib
+import sys
+import threading
+import time
+import unittest
+
+import apprise
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+import notifications
+
+
+class NotificationServer:
+    r"""Server HTTP locale per il target apprise `json://`. Le prime
+        `failures` richieste ricevono un errore 500 e ogni risposta viene
+        inviata dopo `delay` secondi.
+    """
+
+    def __init__(self, failures: int = 0, delay: float = 0.0):
+        self.failures = failures
+        self.delay = delay
+        self.received: list[tuple[float, dict]] = []
+        self._lock = threading.Lock()
+
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                with server._lock:
+                    server.received.append((time.monotonic(), payload))
+                    status: int = 500 if len(server.received) <= server.failures else 200
+                time.sleep(server.delay)
+                self.send_response(status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self._httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f'json://127.0.0.1:{self._httpd.server_address[1]}'
+
+    def __enter__(self) -> 'NotificationServer':
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+def dispatcher(url: str, **kwargs) -> notifications.NotificationDispatcher:
+    notifier = apprise.Apprise()
+    notifier.add(url)
+    return notifications.NotificationDispatcher(
+        lambda title, body: notifier.notify(title=title, body=body),
+        **kwargs
+    ).start()
+
+
+class TestNotificationDispatcher(unittest.TestCase):
+    def test_coalesces_messages_per_plant(self):
+        with NotificationServer() as server:
+            d = dispatcher(server.url, coalesce_delay=0.5)
+            for message in ('a', 'b', 'c'):
+                d.publish(1, message)
+            d.publish(2, 'd')
+            self.assertTrue(d.flush(10))
+            d.stop(1)
+
+        payloads = sorted((p for _, p in server.received), key=lambda p: p['title'])
+        self.assertEqual(len(payloads), 2)
+        self.assertEqual(payloads[0]['title'], 'fv-pgt: impianto 1, 3 notifiche')
+        self.assertEqual(payloads[0]['message'].split('\n'), ['a', 'b', 'c'])
+        self.assertEqual(payloads[1]['title'], 'fv-pgt: impianto 2, 1 notifiche')
+        self.assertEqual(d.stats()['digests'], 2)
+        self.assertEqual(d.stats()['sent'], 2)
+
+    def test_messages_after_delay_are_a_new_digest(self):
+        with NotificationServer() as server:
+            d = dispatcher(server.url, coalesce_delay=0.2)
+            d.publish(1, 'a')
+            time.sleep(0.6)
+            d.publish(1, 'b')
+            self.assertTrue(d.flush(10))
+            d.stop(1)
+
+        self.assertEqual([p['message'] for _, p in server.received], ['a', 'b'])
+
+    def test_retries_with_exponential_backoff(self):
+        with NotificationServer(failures=2) as server:
+            d = dispatcher(server.url, coalesce_delay=0, max_retries=3, backoff=0.2)
+            d.publish(1, 'a')
+            self.assertTrue(d.flush(10))
+            d.stop(1)
+
+        times: list[float] = [t for t, _ in server.received]
+        self.assertEqual(len(times), 3)
+        self.assertGreaterEqual(times[1] - times[0], 0.2)
+        self.assertGreaterEqual(times[2] - times[1], 0.4)
+        stats: dict = d.stats()
+        self.assertEqual((stats['sent'], stats['failed'], stats['retries']), (1, 0, 2))
+
+    def test_gives_up_after_max_retries(self):
+        with NotificationServer(failures=100) as server:
+            d = dispatcher(server.url, coalesce_delay=0, max_retries=2, backoff=0.05)
+            d.publish(1, 'a')
+            self.assertTrue(d.flush(10))
+            d.stop(1)
+
+        self.assertEqual(len(server.received), 3)
+        self.assertEqual((d.stats()['sent'], d.stats()['failed']), (0, 1))
+
+    def test_publish_does_not_block_on_slow_endpoint(self):
+        with NotificationServer(delay=1.0) as server:
+            d = dispatcher(server.url, coalesce_delay=0, max_workers=1)
+            start: float = time.monotonic()
+            for i in range(200):
+                d.publish(i % 5, 'm')
+            self.assertLess(time.monotonic() - start, 0.5)
+            self.assertTrue(d.flush(30))
+            d.stop(1)
+
+        self.assertEqual(d.stats()['published'], 200)
+
+
+class TestIngestionWithSlowNotifications(unittest.TestCase):
+    r"""Le letture che aprono un ticket vengono scritte e confermate senza
+        aspettare l'invio della notifica.
+    """
+
+    DELAY: float = 2.0
+
+    @classmethod
+    def setUpClass(cls):
+        import app as app_module
+        cls.app_module = app_module
+        cls.client = app_module.app.test_client()
+        cls.basic = {'Authorization': 'Basic ' + base64.b64encode(b'admin0:password0').decode()}
+        cls.bearer = {'Authorization': 'Bearer test-notifications'}
+
+        cls.post('/token', {'api_token': 'test-notifications'}, cls.basic)
+        cls.post('/voltage_range', {'lower': 40, 'upper': 300})
+        cls.post('/current_range', {'lower': 10, 'upper': 20})
+        cls.post('/frequency_range', {'lower': 45, 'upper': 51})
+        cls.post('/daily_power_range', {'lower': 1, 'upper': 2})
+        cls.post('/monthly_power_range', {'lower': 1, 'upper': 2})
+        cls.post('/dc_current_system', {'voltage_range_id': 1, 'current_range_id': 1})
+        cls.post('/ac_current_system', {'voltage_range_id': 1, 'current_range_id': 1, 'frequency_range_id': 1})
+        cls.post('/plant_module_system', {'ac_current_id': 1, 'dc_current_id': 1, 'capacity': 3})
+        cls.post('/battery_specification', {'type': 'master', 'voltage_range_id': 1, 'current_range_id': 1, 'capacity': 3})
+        cls.post('/battery', {'name': 'b1', 'battery_specification_id': 1})
+        cls.post('/plant_battery_system', {'battery_ids': [1]})
+        cls.post('/plant_production', {'daily_kwh': 1, 'monthly_kwh': 1, 'daily_power_range_id': 1, 'monthly_power_range_id': 1})
+        cls.post('/owner', {'first_name': 'a', 'last_name': 'b'})
+        cls.post('/plant', {'name': 'p', 'owner_id': 1, 'plant_module_system_id': 1, 'plant_battery_system_id': 1, 'plant_production_id': 1, 'installer': 'x'})
+
+    @classmethod
+    def post(cls, url: str, data: dict, headers: dict | None = None):
+        response = cls.client.post(url, data=json.dumps(data), headers=headers or {}, content_type='application/json')
+        assert response.status_code in (200, 201, 202), (url, response.status_code, response.data)
+        return response
+
+    def test_ingestion_does_not_wait_for_notifications(self):
+        with NotificationServer(delay=self.DELAY) as server:
+            d = dispatcher(server.url, coalesce_delay=0, max_workers=1)
+            self.app_module.notification_dispatcher = d
+            try:
+                now = datetime.datetime.now()
+                for hours in (2, 1.5, 0.1):
+                    start: float = time.monotonic()
+                    self.post('/plant_module_system_sensor_reading', {
+                        'voltage': 1000,
+                        'current': 100,
+                        'frequency': 0.0,
+                        'timestamp': (now - datetime.timedelta(hours=hours)).isoformat(timespec='seconds'),
+                        'plant_module_system_id': 1,
+                        'alarm_code': '-01',
+                    }, self.bearer)
+                    self.assertLess(time.monotonic() - start, self.DELAY / 2)
+
+                self.assertTrue(d.flush(30))
+            finally:
+                self.app_module.notification_dispatcher = None
+                d.stop(1)
+
+        self.assertGreaterEqual(d.stats()['sent'], 1)
+        self.assertTrue(any('aperto ticket' in p['message'] for _, p in server.received))
+
+
+if __name__ == '__main__':
+    unittest.main()
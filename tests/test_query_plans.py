@@ -0,0 +1,176 @@
+r"""Controlla con `EXPLAIN QUERY PLAN` che le query più frequenti di `app.py`
+    usino gli indici dichiarati in `classes_orm`.
+
+    Uso, dalla radice del repository:
+
+        python -m unittest discover tests
+"""
+
+import datetime
+import pathlib
+import sys
+import unittest
+
+from sqlalchemy import create_engine, desc, func, select, tuple_
+from sqlalchemy.orm import Session
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+import classes_orm
+import rollups
+
+
+Pms = classes_orm.PlantModuleSystemSensorReading
+Pbs = classes_orm.PlantBatterySystemSensorReading
+Alm = classes_orm.Alarm
+Tkt = classes_orm.Ticket
+
+now: datetime.datetime = datetime.datetime(2024, 1, 1, 12, 0, 0)
+cutoff: datetime.datetime = now - datetime.timedelta(hours=1)
+
+
+class TestQueryPlans(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.engine = create_engine('sqlite:///:memory:')
+        classes_orm.Base.metadata.create_all(cls.engine)
+        cls.session = Session(cls.engine)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.session.close()
+        cls.engine.dispose()
+
+    def query_plan(self, query) -> str:
+        # Lo stato espanso contiene anche i parametri delle liste di `IN`.
+        compiled = query.compile(self.engine)
+        expanded = compiled.construct_expanded_state(compiled.construct_params())
+        rows = self.session.connection().exec_driver_sql(
+            'EXPLAIN QUERY PLAN ' + expanded.statement,
+            tuple(
+                expanded.processors[name](expanded.parameters[name])
+                if name in expanded.processors else expanded.parameters[name]
+                for name in expanded.positiontup
+            )
+        ).all()
+        return '\n'.join(row[-1] for row in rows)
+
+    def assertPlan(self, query, expected: list[str], forbidden: list[str] = []):
+        plan: str = self.query_plan(query)
+        self.assertTrue(
+            all(e in plan for e in expected) and not any(f in plan for f in forbidden),
+            f'expected {expected}, forbidden {forbidden}, got:\n{plan}'
+        )
+
+    def test_plant_module_readings_latest_n(self):
+        self.assertPlan(
+            select(Pms).filter(Pms.plant_module_system_id == 1).order_by(desc(Pms.timestamp)).limit(10),
+            ['USING INDEX ix_pms_sensor_readings_pms_id_timestamp'],
+            ['TEMP B-TREE'],
+        )
+
+    def test_plant_module_readings_time_range(self):
+        self.assertPlan(
+            select(Pms).filter(
+                Pms.plant_module_system_id == 1,
+                Pms.timestamp >= cutoff,
+                Pms.timestamp <= now
+            ),
+            ['USING INDEX ix_pms_sensor_readings_pms_id_timestamp (plant_module_system_id=? AND timestamp>? AND timestamp<?)'],
+        )
+
+    def test_battery_readings_latest_n(self):
+        self.assertPlan(
+            select(Pbs).filter(Pbs.battery_id == 1).order_by(desc(Pbs.timestamp)).limit(10),
+            ['USING INDEX ix_pbs_sensor_readings_battery_id_timestamp'],
+            ['TEMP B-TREE'],
+        )
+
+    def test_battery_readings_time_range(self):
+        self.assertPlan(
+            select(Pbs).filter(
+                Pbs.battery_id == 1,
+                Pbs.timestamp >= cutoff,
+                Pbs.timestamp <= now
+            ),
+            ['USING INDEX ix_pbs_sensor_readings_battery_id_timestamp (battery_id=? AND timestamp>? AND timestamp<?)'],
+        )
+
+    def test_plant_module_rollup_buckets(self):
+        # Intervalli di 2 ore dagli aggregati a 15 minuti.
+        self.assertPlan(
+            rollups.rollup_query('plant_module_system', [1, 2], 900, 7200, cutoff, now, split_ac_dc=True),
+            ['USING INDEX sqlite_autoindex_sensor_reading_rollups_1 (device_type=? AND device_id=? AND resolution=? AND bucket>? AND bucket<?)'],
+        )
+
+    def test_unticketed_alarms(self):
+        # Caricamento di `alarm_engine`.
+        self.assertPlan(
+            select(
+                Alm.id, Alm.code, Alm.description, Alm.severity_level, Alm.plant_id, Alm.timestamp,
+                Alm.occurrences, Alm.last_seen
+            ).filter(Alm.ticket_id.is_(None)),
+            ['USING COVERING INDEX ix_alarms_unticketed'],
+        )
+
+    def test_stale_tickets(self):
+        # `close_stale_tickets`.
+        self.assertPlan(
+            select(Tkt)
+                .join(Tkt.alarms)
+                .filter(Tkt.code == 'NOT RESOLVED')
+                .group_by(Tkt.id)
+                .having(func.max(func.coalesce(Alm.last_seen, Alm.timestamp)) <= cutoff),
+            ['USING INDEX ix_tickets_code (code=?)', 'USING COVERING INDEX ix_alarms_ticket_id_timestamp (ticket_id=?)'],
+        )
+
+    def test_alarms_of_a_ticket(self):
+        self.assertPlan(
+            select(Alm).filter(Alm.ticket_id == 1),
+            ['USING INDEX ix_alarms_ticket_id_timestamp (ticket_id=?)'],
+        )
+
+    def test_tickets_latest_alarm_first(self):
+        # GET /ticket
+        self.assertPlan(
+            select(Tkt).order_by(desc(Tkt.latest_alarm_at), desc(Tkt.id)).limit(100),
+            ['USING INDEX ix_tickets_latest_alarm_at'],
+            ['TEMP B-TREE'],
+        )
+
+    def test_alarms_latest_first(self):
+        # GET /alarm
+        self.assertPlan(
+            select(Alm).order_by(desc(Alm.timestamp), desc(Alm.id)).limit(1000),
+            ['USING INDEX ix_alarms_timestamp'],
+            ['TEMP B-TREE'],
+        )
+
+    def test_visible_alarms_latest_first(self):
+        # Dashboard, GET /alarm?visible=true
+        self.assertPlan(
+            select(Alm).filter(Alm.visible == True).order_by(desc(Alm.timestamp), desc(Alm.id)).limit(1000),
+            ['USING INDEX ix_alarms_visible_timestamp (visible=?)'],
+            ['TEMP B-TREE'],
+        )
+
+    def test_visible_alarms_next_page(self):
+        self.assertPlan(
+            select(Alm).filter(
+                Alm.visible == True,
+                tuple_(Alm.timestamp, Alm.id) < tuple_(now, 1),
+            ).order_by(desc(Alm.timestamp), desc(Alm.id)).limit(1000),
+            ['USING INDEX ix_alarms_visible_timestamp (visible=? AND timestamp<?)'],
+            ['TEMP B-TREE'],
+        )
+
+    def test_alarms_of_a_plant_latest_first(self):
+        # GET /alarm?plant_id=
+        self.assertPlan(
+            select(Alm).filter(Alm.plant_id == 1).order_by(desc(Alm.timestamp), desc(Alm.id)).limit(1000),
+            ['USING INDEX ix_alarms_plant_id_timestamp (plant_id=?)'],
+            ['TEMP B-TREE'],
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
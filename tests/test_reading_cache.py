@@ -0,0 +1,134 @@
+r"""Test della cache delle ultime letture (`reading_cache.RingBuffer` e
+    `reading_cache.SensorReadingCache`): le richieste che il buffer non può
+    soddisfare per intero devono ritornare None e andare al database.
+
+    Uso, dalla radice del repository:
+
+        python -m unittest discover tests
+"""
+
+import datetime
+import pathlib
+import sys
+import unittest
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+import reading_cache
+
+
+def t(seconds: int) -> datetime.datetime:
+    return datetime.datetime(2024, 1, 1) + datetime.timedelta(seconds=seconds)
+
+
+def buffer_with(capacity: int, seconds: list[int]) -> reading_cache.RingBuffer:
+    buffer = reading_cache.RingBuffer(capacity)
+    for s in seconds:
+        buffer.add(t(s), {'s': s})
+    return buffer
+
+
+def values(items: list | None) -> list[int] | None:
+    return [item['s'] for item in items] if items is not None else None
+
+
+class TestRingBuffer(unittest.TestCase):
+    def test_in_order_wraparound_keeps_the_latest(self):
+        buffer = buffer_with(3, [10, 20, 30, 40, 50])
+        self.assertEqual(len(buffer), 3)
+        self.assertEqual(values(buffer.latest(3)), [30, 40, 50])
+        self.assertEqual(values(buffer.latest(2)), [40, 50])
+        self.assertEqual(buffer.evicted_until, t(20))
+
+    def test_latest_and_window_miss_after_eviction(self):
+        buffer = buffer_with(3, [10, 20, 30, 40, 50])
+        self.assertIsNone(buffer.latest(4))
+        self.assertIsNone(buffer.window(t(20)))
+        self.assertIsNone(buffer.window(t(5), t(45)))
+        self.assertEqual(values(buffer.window(t(21))), [30, 40, 50])
+        self.assertEqual(values(buffer.window(t(30), t(40))), [30, 40])
+
+    def test_without_eviction_everything_is_complete(self):
+        buffer = buffer_with(5, [10, 20, 30])
+        self.assertEqual(values(buffer.latest(10)), [10, 20, 30])
+        self.assertEqual(values(buffer.window(t(0))), [10, 20, 30])
+
+    def test_late_reading_is_inserted_in_order(self):
+        buffer = buffer_with(4, [10, 30, 40])
+        buffer.add(t(20), {'s': 20})
+        self.assertEqual(values(buffer.latest(4)), [10, 20, 30, 40])
+        self.assertIsNone(buffer.evicted_until)
+
+    def test_late_reading_in_a_full_buffer_evicts_the_oldest(self):
+        buffer = buffer_with(3, [10, 30, 40])
+        buffer.add(t(20), {'s': 20})
+        self.assertEqual(values(buffer.latest(3)), [20, 30, 40])
+        self.assertEqual(buffer.evicted_until, t(10))
+        self.assertIsNone(buffer.window(t(10)))
+
+    def test_late_reading_older_than_the_whole_buffer(self):
+        buffer = buffer_with(3, [10, 20, 30])
+        buffer.add(t(5), {'s': 5})
+        self.assertEqual(values(buffer.latest(3)), [10, 20, 30])
+
+        # La lettura non è nel buffer: le richieste che la includono vanno
+        # al database.
+        self.assertEqual(buffer.evicted_until, t(5))
+        self.assertIsNone(buffer.latest(4))
+        self.assertIsNone(buffer.window(t(5)))
+        self.assertEqual(values(buffer.window(t(6))), [10, 20, 30])
+
+
+class TestSensorReadingCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = reading_cache.SensorReadingCache(3, 1024 * 1024)
+
+    def readings(self, seconds: list[int]) -> list[tuple]:
+        return [(t(s), {'s': s}) for s in seconds]
+
+    def test_warm_fills_the_buffer(self):
+        generation = self.cache.generation('a')
+        self.cache.warm('a', self.readings([10, 20, 30, 40]), generation)
+        self.assertEqual(values(self.cache.latest('a', 3)), [20, 30, 40])
+
+        # Con `depth` letture la più vecchia può avere altre letture con lo
+        # stesso timestamp nel database.
+        self.assertIsNone(self.cache.window('a', t(20)))
+        self.assertIsNone(self.cache.latest('a', 4))
+
+        self.cache.add('a', t(50), {'s': 50})
+        self.assertEqual(values(self.cache.latest('a', 3)), [30, 40, 50])
+
+    def test_warm_is_discarded_after_a_concurrent_add(self):
+        generation = self.cache.generation('a')
+
+        # Lettura arrivata mentre `warm_reading_cache` interrogava il
+        # database: potrebbe non essere tra quelle lette.
+        self.cache.add('a', t(50), {'s': 50})
+        self.cache.warm('a', self.readings([10, 20]), generation)
+        self.assertFalse(self.cache.contains('a'))
+        self.assertIsNone(self.cache.latest('a', 1))
+
+    def test_add_to_another_device_does_not_discard_the_warm(self):
+        generation = self.cache.generation('a')
+        self.cache.add('b', t(50), {'s': 50})
+        self.cache.warm('a', self.readings([10, 20]), generation)
+        self.assertEqual(values(self.cache.latest('a', 2)), [10, 20])
+
+    def test_warm_is_discarded_after_clear(self):
+        generation = self.cache.generation('a')
+        self.cache.clear()
+        self.cache.warm('a', self.readings([10, 20]), generation)
+        self.assertFalse(self.cache.contains('a'))
+
+        generation = self.cache.generation('a')
+        self.cache.warm('a', self.readings([10, 20]), generation)
+        self.assertTrue(self.cache.contains('a'))
+
+    def test_readings_of_devices_without_buffer_are_not_kept(self):
+        self.cache.add('a', t(10), {'s': 10})
+        self.assertFalse(self.cache.contains('a'))
+        self.assertEqual(self.cache.stats()['entries'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,155 @@
+from dataclasses import dataclass
+from typing import Any, Callable, Optional
+import threading
+
+import classes_orm
+
+
+@dataclass(frozen=True)
+class Bounds:
+    lower: float
+    upper: float
+
+
+# Per la corrente DC la frequenza è sempre 0.
+DC_FREQUENCY = Bounds(lower=0.0, upper=0.0)
+
+
+@dataclass(frozen=True)
+class CurrentThresholds:
+    voltage: Bounds
+    current: Bounds
+    frequency: Bounds
+
+
+@dataclass(frozen=True)
+class ModuleThresholds:
+    # Limiti già risolti di un modulo impianto per la corrente DC e per la
+    # corrente AC. Un lato è None se il suo sistema di corrente o uno dei
+    # suoi range manca: solo le letture di quel lato vengono rifiutate.
+    dc: Optional[CurrentThresholds]
+    ac: Optional[CurrentThresholds]
+    plant_id: Optional[int]
+
+    def side(self, frequency: float) -> Optional[CurrentThresholds]:
+        r"""Limiti del lato usato da una lettura: DC se la frequenza è 0."""
+        return self.dc if frequency == 0.0 else self.ac
+
+
+@dataclass(frozen=True)
+class BatteryThresholds:
+    voltage: Bounds
+    current: Bounds
+    plant_id: Optional[int]
+
+
+def load_thresholds(session: Any) -> tuple[dict[int, ModuleThresholds], dict[int, BatteryThresholds]]:
+    r"""Legge tutta la topologia degli impianti con una query per tabella e
+        risolve i limiti di ogni modulo impianto e di ogni batteria.
+    """
+    def bounds(obj_class) -> dict[int, Bounds]:
+        return {
+            i: Bounds(lower=lower, upper=upper)
+            for i, lower, upper in session.query(obj_class.id, obj_class.lower, obj_class.upper).all()
+        }
+
+    voltage_ranges = bounds(classes_orm.VoltageRange)
+    current_ranges = bounds(classes_orm.CurrentRange)
+    frequency_ranges = bounds(classes_orm.FrequencyRange)
+
+    Dc = classes_orm.DcCurrentSystem
+    Ac = classes_orm.AcCurrentSystem
+    dc_systems = {
+        i: (voltage_ranges.get(v), current_ranges.get(c))
+        for i, v, c in session.query(Dc.id, Dc.voltage_range_id, Dc.current_range_id).all()
+    }
+    ac_systems = {
+        i: (voltage_ranges.get(v), current_ranges.get(c), frequency_ranges.get(f))
+        for i, v, c, f in session.query(Ac.id, Ac.voltage_range_id, Ac.current_range_id, Ac.frequency_range_id).all()
+    }
+
+    Plant = classes_orm.Plant
+    module_plants: dict[int, int] = {}
+    battery_system_plants: dict[int, int] = {}
+    for plant_id, module_id, battery_system_id in session.query(Plant.id, Plant.plant_module_system_id, Plant.plant_battery_system_id).all():
+        module_plants[module_id] = plant_id
+        battery_system_plants[battery_system_id] = plant_id
+
+    Pms = classes_orm.PlantModuleSystem
+    modules: dict[int, ModuleThresholds] = {}
+    for i, ac_id, dc_id in session.query(Pms.id, Pms.ac_current_id, Pms.dc_current_id).all():
+        dc_voltage, dc_current = dc_systems.get(dc_id, (None, None))
+        ac_voltage, ac_current, ac_frequency = ac_systems.get(ac_id, (None, None, None))
+        modules[i] = ModuleThresholds(
+            dc=CurrentThresholds(dc_voltage, dc_current, DC_FREQUENCY) if None not in (dc_voltage, dc_current) else None,
+            ac=CurrentThresholds(ac_voltage, ac_current, ac_frequency) if None not in (ac_voltage, ac_current, ac_frequency) else None,
+            plant_id=module_plants.get(i),
+        )
+
+    Spec = classes_orm.BatterySpecification
+    specifications = {
+        i: (voltage_ranges.get(v), current_ranges.get(c))
+        for i, v, c in session.query(Spec.id, Spec.voltage_range_id, Spec.current_range_id).all()
+    }
+
+    Bat = classes_orm.Battery
+    batteries: dict[int, BatteryThresholds] = {}
+    for i, spec_id, battery_system_id in session.query(Bat.id, Bat.battery_specification_id, Bat.plant_battery_system_id).all():
+        voltage, current = specifications.get(spec_id, (None, None))
+        if voltage is None or current is None:
+            continue
+        batteries[i] = BatteryThresholds(
+            voltage=voltage,
+            current=current,
+            plant_id=battery_system_plants.get(battery_system_id),
+        )
+
+    return modules, batteries
+
+
+class ThresholdRegistry:
+    r"""Tabella in memoria dei limiti di ogni modulo impianto e di ogni
+        batteria, indicizzata per `plant_module_system_id` e `battery_id`.
+
+        La tabella viene costruita all'avvio e invalidata quando cambia la
+        topologia degli impianti (range, sistemi di corrente, specifiche
+        batteria, impianti). La ricostruzione avviene alla prima lettura
+        successiva, per cui il controllo dei range di una lettura non
+        richiede query al database.
+    """
+
+    def __init__(self, loader: Callable[[], tuple[dict, dict]]):
+        self.loader = loader
+
+        self._tables: tuple[dict, dict] | None = None
+        self._generation: int = 0
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        self._generation += 1
+        self._tables = None
+
+    def reload(self):
+        self.invalidate()
+        self._get_tables()
+
+    def _get_tables(self) -> tuple[dict, dict]:
+        tables = self._tables
+        if tables is None:
+            with self._lock:
+                tables = self._tables
+                if tables is None:
+                    generation = self._generation
+                    tables = self.loader()
+
+                    # Se nel frattempo la tabella è stata invalidata, usiamo
+                    # il risultato solo per questa lettura.
+                    if generation == self._generation:
+                        self._tables = tables
+        return tables
+
+    def plant_module_system(self, plant_module_system_id: int) -> Optional[ModuleThresholds]:
+        return self._get_tables()[0].get(plant_module_system_id)
+
+    def battery(self, battery_id: int) -> Optional[BatteryThresholds]:
+        return self._get_tables()[1].get(battery_id)
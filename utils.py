@@ -1,10 +1,15 @@
-from flask import jsonify
-from typing import Any
-from sqlalchemy import select, and_, or_
+from flask import Response, current_app, jsonify, request, stream_with_context
+from typing import Any, Callable, Iterable, Optional
+from sqlalchemy import select, and_, or_, tuple_
 from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 import mashumaro
+import contextlib
+import datetime
+import itertools
+import json
 import logging
 import time
+import urllib.parse
 
 
 def validate_json(obj_schema, request_data) -> tuple[bool, Any]:
@@ -21,6 +26,43 @@ def validate_json(obj_schema, request_data) -> tuple[bool, Any]:
          return False, (jsonify({'error': 'unknown error: ' + str(e)}), 400,)
 
 
+def validate_dict(obj_schema, data: Any) -> tuple[bool, Any]:
+    r"""Valida un singolo oggetto già decodificato. In caso di errore ritorna
+        il messaggio invece di una risposta HTTP, in modo da poterlo usare per
+        i singoli elementi di un batch o di uno stream.
+    """
+    try:
+        if not isinstance(data, dict):
+            raise ValueError('expecting a JSON object')
+        return True, obj_schema.from_dict(data)
+    except (mashumaro.exceptions.MissingField,
+            mashumaro.exceptions.ExtraKeysError,
+            mashumaro.exceptions.UnserializableField,
+            mashumaro.exceptions.InvalidFieldValue,
+            ValueError) as e:
+        return False, str(e)
+    except Exception as e:
+        return False, 'unknown error: ' + str(e)
+
+
+def validate_json_list(obj_schema, request_data, max_items: int = 0) -> tuple[bool, Any]:
+    r"""Come `validate_json`, ma per un array JSON di oggetti. Ogni elemento
+        viene validato singolarmente: il risultato è una lista di tuple
+        `(ok, oggetto o messaggio di errore)`, una per elemento.
+    """
+    try:
+        items = json.loads(request_data)
+    except ValueError as e:
+        return False, (jsonify({'error': str(e)}), 400,)
+
+    if not isinstance(items, list):
+        return False, (jsonify({'error': 'expecting a JSON array'}), 400,)
+    if max_items > 0 and len(items) > max_items:
+        return False, (jsonify({'error': f'too many items: maximum is {max_items}'}), 413,)
+
+    return True, [validate_dict(obj_schema, item) for item in items]
+
+
 def new_db_object(obj: Any, db: Any, max_retries: int = 10000, delay: float = 0.1, return_raw: bool = False) -> tuple:
     r"""Funzione di convenienza per salvare oggetti nel database e ritonare una risposta."""
     attempt: int = 0
@@ -53,10 +95,188 @@ def new_db_object(obj: Any, db: Any, max_retries: int = 10000, delay: float = 0.
     return jsonify({'error': 'Failed to add object after multiple attempts.'}), 500
 
 
-def list_db_objects(obj_class: Any, db: Any) -> Any:
+def parse_timestamp(value: str) -> datetime.datetime:
+    r"""Timestamp ISO senza fuso orario, come nel database: un timestamp
+        con fuso orario viene prima convertito in UTC.
+    """
+    timestamp: datetime.datetime = datetime.datetime.fromisoformat(value)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+
+def page_args(args: Any, max_page_size: int = 0) -> tuple[bool, Any]:
+    r"""Parametri di paginazione di una richiesta: `limit` (al massimo
+        `max_page_size`, che è anche il default), `after_id` e
+        `after_timestamp` (timestamp ISO). Con `max_page_size` 0 e senza
+        `limit` la pagina non ha limite.
+    """
+    try:
+        limit: Optional[int] = int(args['limit']) if 'limit' in args else None
+        after_id: Optional[int] = int(args['after_id']) if 'after_id' in args else None
+        after_timestamp: Optional[datetime.datetime] = (
+            parse_timestamp(args['after_timestamp']) if 'after_timestamp' in args else None
+        )
+    except ValueError as e:
+        return False, (jsonify({'error': str(e)}), 400,)
+
+    if limit is not None and limit < 1:
+        return False, (jsonify({'error': 'limit must be a positive integer'}), 400,)
+    if max_page_size > 0:
+        limit = min(limit or max_page_size, max_page_size)
+
+    return True, {'limit': limit, 'after_id': after_id, 'after_timestamp': after_timestamp}
+
+
+def keyset_query(query: Any, page: dict, id_column: Any, timestamp_column: Any = None, remaining: Optional[int] = None, newest_first: bool = False) -> Any:
+    r"""Aggiunge a `query` il filtro e l'ordinamento della paginazione per
+        chiave: in ordine di id o, se c'è `after_timestamp` e la tabella ha
+        un timestamp, di timestamp e id. Con `newest_first` l'ordine è
+        sempre decrescente di timestamp e id e la posizione è data da
+        `after_timestamp`: un `after_id` da solo viene ignorato. Viene letta una riga in più
+        del limite (o di `remaining`, le righe che mancano alla pagina) per
+        sapere se esiste una pagina successiva.
+    """
+    if newest_first:
+        if page['after_timestamp'] is not None:
+            if page['after_id'] is not None:
+                # Con il confronto tra tuple SQLite limita l'intervallo letto
+                # dall'indice sul timestamp, con `OR` no.
+                query = query.where(
+                    tuple_(timestamp_column, id_column) < tuple_(page['after_timestamp'], page['after_id'])
+                )
+            else:
+                query = query.where(timestamp_column < page['after_timestamp'])
+        query = query.order_by(timestamp_column.desc(), id_column.desc())
+    elif page['after_timestamp'] is not None and timestamp_column is not None:
+        if page['after_id'] is not None:
+            query = query.where(or_(
+                timestamp_column > page['after_timestamp'],
+                and_(timestamp_column == page['after_timestamp'], id_column > page['after_id'])
+            ))
+        else:
+            query = query.where(timestamp_column > page['after_timestamp'])
+        query = query.order_by(timestamp_column, id_column)
+    else:
+        if page['after_id'] is not None:
+            query = query.where(id_column > page['after_id'])
+        query = query.order_by(id_column)
+
+    limit: Optional[int] = remaining if remaining is not None else page['limit']
+    if limit is not None:
+        query = query.limit(limit + 1)
+    return query
+
+
+def page_response(items: list, page: dict, cursor: Callable[[Any], dict], serialize: Callable[[Any], dict]) -> Any:
+    r"""Risposta con le righe di una pagina lette con `keyset_query`. Se ci
+        sono altre righe, l'URL della pagina successiva è nell'header `Link`
+        (`rel="next"`), con i parametri ritornati da `cursor` per l'ultima
+        riga della pagina.
+    """
+    limit: Optional[int] = page['limit']
+    has_next: bool = limit is not None and len(items) > limit
+    if has_next:
+        items = items[:limit]
+
+    response = jsonify([serialize(item) for item in items])
+    if has_next:
+        args = request.args.copy()
+        args['limit'] = str(limit)
+        args.poplist('after_id')
+        args.poplist('after_timestamp')
+        for name, value in cursor(items[-1]).items():
+            args[name] = value
+        next_url: str = request.base_url + '?' + urllib.parse.urlencode(list(args.items(multi=True)))
+        response.headers['Link'] = f'<{next_url}>; rel="next"'
+    return response
+
+
+def stream_json(items: Callable[[], Iterable[dict]], batch_size: int = 1000, lock: Any = None) -> Response:
+    r"""Risposta con un array JSON scritto un po' alla volta mentre si
+        scorrono gli elementi ritornati da `items` (per esempio le righe di
+        una query con `yield_per`), invece di costruire prima tutta la
+        lista: la memoria usata non dipende dal numero di elementi. Gli
+        elementi vengono inviati a gruppi di `batch_size`.
+
+        `items` viene chiamata solo quando inizia l'invio della risposta,
+        dopo la fine della richiesta: le query vanno fatte lì dentro. Il
+        `lock` (se indicato) viene acquisito solo mentre si legge un gruppo
+        di elementi, non mentre il gruppo viene inviato: un client lento non
+        blocca le altre richieste. Il codice di stato è sempre 200: un
+        errore durante la lettura interrompe la risposta a metà.
+    """
+    guard = lock if lock is not None else contextlib.nullcontext()
+
+    def generate():
+        with guard:
+            rows = iter(items())
+        separator: str = '['
+        while True:
+            with guard:
+                batch: list = list(itertools.islice(rows, batch_size))
+            if not batch:
+                break
+            yield separator + ','.join(current_app.json.dumps(item, separators=(',', ':')) for item in batch)
+            separator = ','
+        yield ']\n' if separator == ',' else '[]\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+
+def id_cursor(obj: Any) -> dict:
+    r"""Cursore della pagina successiva per le liste in ordine di id."""
+    return {'after_id': str(obj.id)}
+
+
+def fieldset_args(args: Any) -> tuple[Optional[list[str]], list[str]]:
+    r"""Parametri `fields` (chiavi da ritornare, di default tutte) e
+        `include` (dati aggiuntivi da calcolare), separati da virgola.
+    """
+    def names(name: str) -> list[str]:
+        return list(dict.fromkeys(n.strip() for n in args.get(name, '').split(',') if n.strip()))
+
+    return (names('fields') if 'fields' in args else None), names('include')
+
+
+def serialize_objects(objs: list, args: Any, related: Optional[dict[str, Callable[[list], dict]]] = None) -> list[dict]:
+    r"""Serializza gli oggetti secondo i parametri `fields` e `include` della
+        richiesta (vedi `fieldset_args`). `related` associa ogni valore
+        accettato da `include` alla funzione che lo calcola per tutti gli
+        oggetti insieme, con una sola query: ritorna un dizionario id
+        oggetto -> valore. Solleva ValueError se `include` non è valido.
+    """
+    fields, include = fieldset_args(args)
+    invalid: list[str] = [n for n in include if related is None or n not in related]
+    if invalid:
+        raise ValueError(f'invalid include {", ".join(invalid)}: expecting one of {", ".join(related or [])}')
+
+    serialized: list[dict] = [obj.serialize() for obj in objs]
+    for name in include:
+        values: dict = related[name](objs)
+        for obj, d in zip(objs, serialized):
+            d[name] = values[obj.id]
+
+    if fields is not None:
+        serialized = [{k: v for k, v in d.items() if k in fields} for d in serialized]
+    return serialized
+
+
+def list_db_objects(obj_class: Any, db: Any, max_page_size: int = 0, related: Optional[dict[str, Callable[[list], dict]]] = None) -> Any:
+    r"""Lista di oggetti in ordine di id, paginata per chiave (vedi
+        `page_args`), con i parametri `fields` e `include` (vedi
+        `serialize_objects`).
+    """
+    ok, page = page_args(request.args, max_page_size)
+    if not ok:
+        return page
+
     try:
-        objs = db.session.query(obj_class).all()
-        return jsonify([obj.serialize() for obj in objs])
+        objs = db.session.scalars(keyset_query(select(obj_class), page, obj_class.id)).all()
+        items: list[tuple] = list(zip(objs, serialize_objects(objs, request.args, related)))
+        return page_response(items, page, lambda item: id_cursor(item[0]), lambda item: item[1])
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({"error": "could not retrieve objects"}), 500
 
@@ -72,8 +292,10 @@ def detail_raw_db_object(obj_class: Any, obj_id: int, db: Any) -> Any:
         return jsonify({"error": "Could not retrieve object"}), 500
 
 
-def detail_db_object(obj_class: Any, obj_id: int, db: Any, respond_api: bool = True, obj_name: str = '') -> Any:
-    r"""Funzione di convenienza per vedere i dettagli di un oggetto."""
+def detail_db_object(obj_class: Any, obj_id: int, db: Any, respond_api: bool = True, obj_name: str = '', related: Optional[dict[str, Callable[[list], dict]]] = None) -> Any:
+    r"""Funzione di convenienza per vedere i dettagli di un oggetto, con i
+        parametri `fields` e `include` (vedi `serialize_objects`).
+    """
     obj = detail_raw_db_object(obj_class, obj_id, db)
 
     if obj_name == '':
@@ -86,7 +308,10 @@ def detail_db_object(obj_class: Any, obj_id: int, db: Any, respond_api: bool = T
             return obj
     else:
         if respond_api:
-            return jsonify(obj.serialize()), 200
+            try:
+                return jsonify(serialize_objects([obj], request.args, related)[0]), 200
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
         else:
             return obj
 